@@ -3,15 +3,30 @@
 # Standard library imports
 
 # Remote library imports
-from flask import request, jsonify
+from flask import request, jsonify, send_from_directory
 from flask_restful import Resource
 from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from sqlalchemy import func, select, union
+from sqlalchemy.orm import selectinload
 from datetime import datetime
 
 # Local imports
 from config import app, db, api
-from models import User, Customer, Seller, Product, Cart, Order, OrderHistory, Category
+from models import User, Customer, Seller, Product, Cart, Order, OrderHistory, ArchivedOrder, Category, CategoryStats, RelatedProduct
+import reservations
+import jobs
+import images
+import category_stats
+from catalog_query import parse_product_filters, product_query
+import catalog_snapshot
+import order_archive
+from idempotency import idempotent
+import singleflight
+import catalog_changes
+import product_updates
+import cart_store
+import sharding
 
 # Initialize app components
 db.init_app(app)
@@ -43,12 +58,11 @@ def login():
 @app.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
-    print(data)
     username = data.get('username')
     password = data.get('password')
     role = data.get('role')
-    print(password,role,username)
-    
+    app.logger.debug("Registering %s as %s", username, role)
+
     if not username or not password or not role:
         return jsonify({"message": "Missing required fields"}), 400
 
@@ -97,8 +111,12 @@ def register():
     return jsonify({"message": "User registered successfully!"}), 201
 
 @app.route('/categories/products', methods=['GET'])
+@singleflight.coalesced
 def get_all_categories_with_products():
-    categories = Category.query.all()
+    # Read first: the response then reflects at least every change up to this id
+    change_id = catalog_changes.current_id()
+    # One query for the categories and one for all their products, not one per category
+    categories = Category.query.options(selectinload(Category.products)).all()
     response = []
 
     for category in categories:
@@ -116,36 +134,155 @@ def get_all_categories_with_products():
                 'name': product.name,
                 'description': product.description,
                 'price': product.price,
+                'stock': product.stock,
                 'image_url': product.image_url,
+                'thumbnails': images.thumbnail_urls(product.image_hash),
                 # Add any other fields from the Product model that you need
             }
             category_data['products'].append(product_data)
 
         response.append(category_data)
 
-    return jsonify(response), 200
+    # Clients open GET /catalog/changes from this id to catch up with what this copy misses
+    return jsonify(response), 200, {'X-Catalog-Change-Id': str(change_id)}
 
 
 
 @app.route('/categories', methods=['GET'])
 def get_categories():
     categories = Category.query.all()
-    return jsonify([category.to_dict() for category in categories]), 200
+    # Columns only: following category.products back to the category recurses forever
+    return jsonify([category.to_dict(only=('id', 'name')) for category in categories]), 200
+
+# Category menu with product counts, read from the denormalized stats table
+@app.route('/categories/summary', methods=['GET'])
+@singleflight.coalesced
+def get_categories_summary():
+    rows = db.session.query(Category, CategoryStats).outerjoin(CategoryStats).order_by(Category.id).all()
+    summary = [
+        {
+            'id': category.id,
+            'name': category.name,
+            'product_count': stats.product_count if stats else 0,
+            'in_stock_count': stats.in_stock_count if stats else 0,
+            'min_price': stats.min_price if stats else None,
+            'max_price': stats.max_price if stats else None,
+        }
+        for category, stats in rows
+    ]
+    return jsonify(summary), 200
+
+# Facet counts for the product search sidebar, from the in-memory catalog snapshot
+@app.route('/products/facets', methods=['GET'])
+@singleflight.coalesced
+def get_product_facets():
+    filters, errors = parse_product_filters(request.args)
+    if filters['q']:
+        errors['q'] = 'is not supported for facet counts'
+    if errors:
+        return jsonify({'message': 'Invalid query parameters', 'errors': errors}), 400
+
+    counts = catalog_snapshot.get_snapshot().facet_counts(
+        category_id=filters['category_id'],
+        seller_id=filters['seller_id'],
+        min_price=filters['min_price'],
+        max_price=filters['max_price'],
+        in_stock=filters['in_stock'],
+    )
+    return jsonify(counts), 200
+
+# "Customers also bought", precomputed by recommendations.py
+@app.route('/products/<int:id>/related', methods=['GET'])
+@singleflight.coalesced
+def get_related_products(id):
+    rows = db.session.query(RelatedProduct.score, Product) \
+        .join(Product, Product.id == RelatedProduct.related_product_id) \
+        .filter(RelatedProduct.product_id == id) \
+        .order_by(RelatedProduct.rank).all()
+    related = [
+        {
+            'id': product.id,
+            'name': product.name,
+            'price': product.price,
+            'image_url': product.image_url,
+            'thumbnails': images.thumbnail_urls(product.image_hash),
+            'score': score,
+        }
+        for score, product in rows
+    ]
+    return jsonify({'product_id': id, 'related': related}), 200
+
+# Per-worker counters of the coalesced catalog reads
+@app.route('/metrics/singleflight', methods=['GET'])
+def singleflight_metrics():
+    return jsonify(singleflight.flight.stats()), 200
+
+# Live stock and price changes as server-sent events, optionally for some categories only
+@app.route('/catalog/changes', methods=['GET'])
+def catalog_change_stream():
+    errors = {}
+    last_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    if last_id is not None:
+        try:
+            last_id = int(last_id)
+        except ValueError:
+            errors['last_event_id'] = 'must be an integer'
+    category_ids = set()
+    for value in request.args.getlist('category_id'):
+        try:
+            category_ids.add(int(value))
+        except ValueError:
+            errors['category_id'] = 'must be an integer'
+    if errors:
+        return jsonify({'message': 'Invalid query parameters', 'errors': errors}), 400
+
+    events = catalog_changes.stream(last_id, category_ids)
+    if events is None:
+        retry_after = app.config['CATALOG_STREAM_BUSY_RETRY_SECONDS']
+        return jsonify({'message': 'Too many open change streams, please retry'}), 503, \
+            {'Retry-After': str(retry_after)}
+    response = app.response_class(events, mimetype='text/event-stream',
+                                  headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Also runs when the client goes away mid-stream
+    response.call_on_close(catalog_changes.stream_closed)
+    return response
 
 # Route to get products by category id
 @app.route('/categories/<int:category_id>/products', methods=['GET'])
 def get_products_by_category(category_id):
     products = Product.query.filter_by(category_id=category_id).all()
-    return jsonify([product.to_dict() for product in products]), 200
-
-# @app.route('/products')
-# def get_products():
-#     category = request.args.get('category')
-#     if category:
-#         products = Product.query.filter_by(category=category).all()
-#     else:
-#         products = Product.query.all()
-#     return jsonify([product.to_dict() for product in products])
+    return jsonify([product.to_dict(only=('id', 'name', 'description', 'price', 'stock', 'image_url',
+                                          'category_id', 'seller_id')) for product in products]), 200
+
+# Product search: filter by category, seller, price range, stock and name, sorted and paged
+@app.route('/products', methods=['GET'])
+@singleflight.coalesced
+def get_products():
+    filters, errors = parse_product_filters(request.args)
+    if errors:
+        return jsonify({'message': 'Invalid query parameters', 'errors': errors}), 400
+
+    products = db.session.execute(product_query(filters)).scalars().all()
+    has_more = len(products) > filters['limit']
+    products = products[:filters['limit']]
+
+    return jsonify({
+        'products': [
+            {
+                'id': product.id,
+                'name': product.name,
+                'description': product.description,
+                'price': product.price,
+                'stock': product.stock,
+                'image_url': product.image_url,
+                'thumbnails': images.thumbnail_urls(product.image_hash),
+                'category_id': product.category_id,
+                'seller_id': product.seller_id,
+            }
+            for product in products
+        ],
+        'next_offset': filters['offset'] + filters['limit'] if has_more else None,
+    }), 200
 
 
 
@@ -162,8 +299,10 @@ def get_seller_products():
             "description": product.description,
             "price": product.price,
             "stock": product.stock,
-            "image": product.image,
-            "category_id": product.category_id
+            "image": product.image_url,
+            "thumbnails": images.thumbnail_urls(product.image_hash),
+            "category_id": product.category_id,
+            "version": product.version
         }
         for product in products
     ]
@@ -182,20 +321,80 @@ def add_product():
         description=data['description'],
         price=data['price'],
         stock=data['stock'],
-        image=data['image'],
+        image_url=data.get('image'),
         category_id=data['category_id']
     )
     db.session.add(new_product)
+    category_stats.product_added(new_product.category_id, new_product.price, new_product.stock)
+    db.session.flush()
+    catalog_changes.record([{'id': new_product.id, 'category_id': new_product.category_id,
+                             'seller_id': new_product.seller_id, 'price': new_product.price,
+                             'stock': new_product.stock}])
     db.session.commit()
+    singleflight.invalidate()
+    catalog_changes.feed.poke()
 
     return jsonify({"message": "Product added successfully", "product_id": new_product.id}), 201
 
+# Bulk price/stock edits, each guarded by the version it was based on
+@app.route('/seller/products', methods=['PATCH'])
+@jwt_required()
+def update_products():
+    current_user = get_jwt_identity()
+    updates, errors = product_updates.parse_updates(request.get_json(silent=True))
+    if errors:
+        return jsonify({'message': 'Invalid product updates', 'errors': errors}), 400
+
+    applied, conflicts, missing = product_updates.apply_updates(current_user['id'], updates)
+    if applied:
+        singleflight.invalidate()
+        catalog_changes.feed.poke()
+
+    return jsonify({
+        'updated': [{'id': product['id'], 'version': product['version']} for product in applied],
+        'conflicts': conflicts,
+        'not_found': missing,
+    }), 409 if conflicts and not applied else 200
+
+@app.route('/seller/products/<int:id>/image', methods=['POST'])
+@jwt_required()
+def upload_product_image(id):
+    current_user = get_jwt_identity()
+    product = Product.query.get_or_404(id)
+    if product.seller_id != current_user['id']:
+        return jsonify({'message': 'Unauthorized access'}), 403
+
+    upload = request.files.get('image')
+    if not upload:
+        return jsonify({'message': 'Missing image file'}), 400
+
+    try:
+        product.image_hash = images.store_upload(upload.read())
+    except images.InvalidImage as e:
+        return jsonify({'message': str(e)}), 400
+    except images.ThumbnailsUnavailable as e:
+        return jsonify({'message': str(e)}), 503
+    db.session.commit()
+    singleflight.invalidate()
+
+    return jsonify({"message": "Image uploaded successfully",
+                    "thumbnails": images.thumbnail_urls(product.image_hash)}), 201
+
+@app.route('/images/<path:filename>', methods=['GET'])
+def serve_image(filename):
+    # File names are content digests, so a cached copy never goes stale
+    response = send_from_directory(images.image_root(), filename,
+                                   max_age=app.config['IMAGE_CACHE_MAX_AGE'])
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/seller/products/<int:id>', methods=['GET'])
 @jwt_required()
 def seller_product(id):
     product = Product.query.get_or_404(id)
     return jsonify({"id": product.id, "name": product.name, "description": product.description,
-                    "price": product.price, "stock": product.stock, "image": product.image,
+                    "price": product.price, "stock": product.stock, "image_url": product.image_url,
                     "category_id": product.category_id, "seller_id": product.seller_id}), 200
 
 @app.route('/seller/buyers', methods=['GET'])
@@ -206,12 +405,28 @@ def seller_buyers():
     if not seller:
         return jsonify({'message': 'Seller not found'}), 404
 
-    customers = Customer.query.all()
+    # Orders are spread over the customer shards: ask each one for this seller's buyers
+    product_ids = [id for (id,) in db.session.query(Product.id).filter_by(seller_id=current_user['id'])]
+    def shard_buyers():
+        return db.session.execute(union(*(
+            select(table.customer_id).where(table.product_id.in_(product_ids)) for table in (Order, ArchivedOrder)
+        ))).scalars().all()
+    customer_ids = sorted({id for ids in sharding.scatter(shard_buyers) for id in ids})
+
+    customers = Customer.query.filter(Customer.id.in_(customer_ids)).all()
     customer_list = [{"id": c.id, "name": c.name, "email": c.email, "address": c.address, "phone_no": c.phone_no}
                      for c in customers]
 
     return jsonify({"buyers": customer_list}), 200
 
+# Order lists are paged newest first: pass the previous page's next_before to get the next one
+def order_page_args():
+    limit = request.args.get('limit', app.config['ORDER_PAGE_SIZE'], type=int)
+    return {
+        'before': request.args.get('before', type=int),
+        'limit': max(1, min(limit, app.config['ORDER_PAGE_MAX_SIZE'])),
+    }
+
 @app.route('/buyers/orders', methods=['GET'])
 @jwt_required()
 def buyers_orders():
@@ -219,8 +434,9 @@ def buyers_orders():
     customer = Customer.query.filter_by(user_id=current_user['id']).first()
     if not customer:
         return jsonify({'message': 'Customer not found'}), 404
+    sharding.route_customer(customer.id)
 
-    orders = Order.query.filter_by(customer_id=customer.id).all()
+    orders, next_before = order_archive.orders_page(customer.id, **order_page_args())
     order_list = [
         {
             "id": o.id,
@@ -230,7 +446,7 @@ def buyers_orders():
         }
         for o in orders
     ]
-    return jsonify({"orders": order_list}), 200
+    return jsonify({"orders": order_list, "next_before": next_before}), 200
 
 @app.route('/admin/seller', methods=['GET'])
 @jwt_required()
@@ -251,6 +467,30 @@ def admin_seller():
     ]
     return jsonify({"sellers": seller_list}), 200
 
+# Order totals per customer shard and overall, recent and archived orders together
+@app.route('/admin/orders/summary', methods=['GET'])
+@jwt_required()
+def admin_orders_summary():
+    current_user = get_jwt_identity()
+    if current_user['role'] != 'admin':
+        return jsonify({'message': 'Unauthorized access'}), 403
+
+    def shard_summary():
+        count, revenue = 0, 0
+        for table in (Order, ArchivedOrder):
+            rows, total = db.session.execute(
+                select(func.count(table.id), func.coalesce(func.sum(table.total_price), 0))
+            ).one()
+            count, revenue = count + rows, revenue + total
+        return {'shard': sharding.current_shard(), 'orders': count, 'revenue': round(revenue, 2)}
+    shards = sharding.scatter(shard_summary)
+
+    return jsonify({
+        'orders': sum(shard['orders'] for shard in shards),
+        'revenue': round(sum(shard['revenue'] for shard in shards), 2),
+        'shards': shards,
+    }), 200
+
 @app.route('/admin/seller/<int:id>/decline', methods=['PUT'])
 @jwt_required()
 def admin_seller_decline(id):
@@ -268,7 +508,7 @@ def admin_seller_decline(id):
 def admin_seller_approve(id):
     current_user = get_jwt_identity()
     if current_user['role'] != 'admin':
-        return jsonify({'message': 'Unauthorized access'}), 4037
+        return jsonify({'message': 'Unauthorized access'}), 403
 
     seller = Seller.query.get_or_404(id)
     seller.status = True  # Assuming status is a boolean field for approval
@@ -308,14 +548,18 @@ def admin_seller_approve(id):
 
 #     return jsonify({'msg': 'Product added to cart', 'cart_item_id': cart_item.id}), 201
 
+def is_positive_int(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
 @app.route('/cart', methods=['POST'])
 @jwt_required()
+@idempotent
 def add_to_cart():
     user_identity = get_jwt_identity()
     customer = Customer.query.filter_by(user_id=user_identity['id']).first()
-    print(customer)
     if not customer:
         return jsonify({'msg': 'Customer not found'}), 404
+    sharding.route_customer(customer.id)
 
     data = request.get_json()
     product_id = data.get('productId')
@@ -323,19 +567,21 @@ def add_to_cart():
 
     if not product_id or not quantity:
         return jsonify({'msg': 'Missing productId or quantity'}), 400
+    # Holds and the checkout decrement trust the quantity: a negative one would add stock
+    if not is_positive_int(product_id) or not is_positive_int(quantity):
+        return jsonify({'msg': 'productId and quantity must be positive integers'}), 400
 
     product = Product.query.get_or_404(product_id)
 
-    cart_item = Cart.query.filter_by(customer_id=customer.id, product_id=product.id).first()
-    if cart_item:
-        cart_item.quantity += quantity
-    else:
-        cart_item = Cart(customer_id=customer.id, product_id=product.id, quantity=quantity)
-        db.session.add(cart_item)
+    cart_line = cart_store.store.add(customer.id, product.id, quantity)
+    if cart_line is None:
+        db.session.rollback()
+        available = reservations.available_stock(product.id, exclude_customer_id=customer.id)
+        return jsonify({'msg': 'Not enough stock', 'available': available}), 409
 
     db.session.commit()
 
-    return jsonify({'msg': 'Product added to cart', 'cart_item_id': cart_item.id}), 201
+    return jsonify({'msg': 'Product added to cart', 'cart_item_id': cart_line.id}), 201
 
 # Get the current user's cart items
 @app.route('/cart/get', methods=['GET'])
@@ -345,19 +591,22 @@ def get_cart_items():
     customer = Customer.query.filter_by(user_id=user_identity['id']).first()
     if not customer:
         return jsonify({'msg': 'Customer not found'}), 404
+    sharding.route_customer(customer.id)
 
-    cart_items = Cart.query.filter_by(customer_id=customer.id).all()
+    cart_lines = cart_store.store.lines(customer.id)
+    products = {product.id: product for product in
+                Product.query.filter(Product.id.in_([line.product_id for line in cart_lines]))}
     items = [
         {
-            'id': item.id,
-            'product_id': item.product.id,
-            'name': item.product.name,
-            'image':item.product.image,
-            'quantity': item.quantity,
-            'price': item.product.price,
-            'total': item.quantity * item.product.price,
+            'id': line.id,
+            'product_id': line.product_id,
+            'name': products[line.product_id].name,
+            'image': products[line.product_id].image_url,
+            'quantity': line.quantity,
+            'price': products[line.product_id].price,
+            'total': line.quantity * products[line.product_id].price,
         }
-        for item in cart_items
+        for line in cart_lines
     ]
 
     return jsonify({'cart_items': items}), 200
@@ -370,12 +619,10 @@ def remove_from_cart(id):
     customer = Customer.query.filter_by(user_id=user_identity['id']).first()
     if not customer:
         return jsonify({'msg': 'Customer not found'}), 404
+    sharding.route_customer(customer.id)
 
-    cart_item = Cart.query.filter_by(id=id, customer_id=customer.id).first()
-    if not cart_item:
+    if not cart_store.store.remove(customer.id, id):
         return jsonify({'msg': 'Cart item not found'}), 404
-
-    db.session.delete(cart_item)
     db.session.commit()
 
     return jsonify({'msg': 'Product removed from cart'}), 200
@@ -391,27 +638,62 @@ def remove_from_cart(id):
 
 @app.route('/orders', methods=['POST'])
 @jwt_required()
+@idempotent
 def place_order():
     user_identity = get_jwt_identity()
     customer = Customer.query.filter_by(user_id=user_identity['id']).first()
     if not customer:
         return jsonify({'msg': 'Customer not found'}), 404
+    # Read once: the commit below expires the customer and customer.id would reload it
+    customer_id = customer.id
+    sharding.route_customer(customer_id)
 
-    cart_items = Cart.query.filter_by(customer_id=customer.id).all()
+    # Orders are placed from the cart table, so write out any pending cart changes first
+    cart_store.store.flush([customer_id])
+    cart_items = Cart.query.filter_by(customer_id=customer_id).all()
     if not cart_items:
         return jsonify({'msg': 'No items in cart'}), 400
 
+    failed = reservations.convert(customer_id, [(item.product_id, item.quantity) for item in cart_items])
+    if failed:
+        db.session.rollback()
+        return jsonify({'msg': 'Not enough stock', 'product_ids': failed}), 409
+
+    quantities = {item.product_id: item.quantity for item in cart_items}
+    prices = {}
+    changed = []
+    for product_id, category_id, seller_id, stock, price in db.session.query(
+            Product.id, Product.category_id, Product.seller_id, Product.stock, Product.price
+    ).filter(Product.id.in_(quantities)):
+        category_stats.stock_changed(category_id, stock + quantities[product_id], stock)
+        prices[product_id] = price
+        changed.append({'id': product_id, 'category_id': category_id, 'seller_id': seller_id,
+                        'price': price, 'stock': stock})
+    catalog_changes.record(changed)
+
+    order_date = datetime.now()
+    orders = []
     for item in cart_items:
         order = Order(
-            customer_id=customer.id,
+            customer_id=customer_id,
             product_id=item.product_id,
             quantity=item.quantity,
+            total_price=round(item.quantity * prices[item.product_id], 2),
+            order_date=order_date,
             status='pending'
         )
         db.session.add(order)
+        orders.append(order)
         db.session.delete(item)
 
+    # Derived data is filled in by the background worker
+    db.session.flush()
+    jobs.enqueue('record_order_history', {'customer_id': customer_id, 'order_ids': [order.id for order in orders]})
+    jobs.enqueue('update_related_products', {'customer_id': customer_id})
     db.session.commit()
+    singleflight.invalidate()
+    catalog_changes.feed.poke()
+    cart_store.store.clear(customer_id)
 
     return jsonify({'msg': 'Order placed successfully'}), 201
 
@@ -422,8 +704,9 @@ def view_orders():
     customer = Customer.query.filter_by(user_id=user_identity['id']).first()
     if not customer:
         return jsonify({'msg': 'Customer not found'}), 404
+    sharding.route_customer(customer.id)
 
-    orders = Order.query.filter_by(customer_id=customer.id).all()
+    orders, next_before = order_archive.orders_page(customer.id, **order_page_args())
     order_list = [
         {
             'order_id': order.id,
@@ -434,7 +717,8 @@ def view_orders():
         for order in orders
     ]
 
-    return jsonify({'orders': order_list}), 200
+    return jsonify({'orders': order_list, 'next_before': next_before}), 200
 
 if __name__ == '__main__':
+    # Development server only; run production with gunicorn (see gunicorn.conf.py)
     app.run(port=5555, debug=True)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+# Memory and latency of the columnar catalog snapshot on a synthetic catalog.
+#
+#     python bench_catalog_snapshot.py [product_count]
+
+# Standard library imports
+import statistics
+import sys
+import threading
+import time
+from collections import namedtuple
+
+# Remote library imports
+import numpy as np
+
+# Local imports
+from config import app
+from catalog_snapshot import CatalogSnapshot
+
+# A catalog_change row as the change feed hands it over
+Change = namedtuple('Change', ['id', 'product_id', 'category_id', 'seller_id', 'price', 'stock'])
+
+QUERIES = {
+    'no filters': {},
+    'category': {'category_id': 7},
+    'category + price range': {'category_id': 7, 'min_price': 100, 'max_price': 500},
+    'seller + in stock': {'seller_id': 1234, 'in_stock': True},
+    'all filters': {'category_id': 7, 'seller_id': 1234, 'min_price': 100, 'max_price': 500, 'in_stock': True},
+}
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rng = np.random.default_rng(42)
+
+    snapshot = CatalogSnapshot(app.config['CATALOG_PRICE_BUCKETS'])
+    start = time.perf_counter()
+    snapshot.load_arrays(
+        np.arange(1, count + 1),
+        rng.integers(1, 50, count),
+        rng.integers(1, 5000, count),
+        np.round(rng.lognormal(5, 1, count), 2),
+        rng.integers(0, 100, count),
+    )
+    load_ms = (time.perf_counter() - start) * 1000
+
+    print(f"Products:      {len(snapshot):,}")
+    print(f"Memory:        {snapshot.nbytes / 1024 / 1024:.1f} MiB ({snapshot.nbytes / count:.0f} bytes/product)")
+    print(f"Load:          {load_ms:.1f} ms")
+    print()
+    print(f"{'facet query':<26}{'median ms':>10}{'p99 ms':>10}{'cached ms':>11}")
+    for name, filters in QUERIES.items():
+        def uncached():
+            snapshot._results.clear()
+            snapshot.facet_counts(**filters)
+        median, p99 = timed(uncached, 50)
+        cached, _ = timed(lambda: snapshot.facet_counts(**filters), 1000)
+        print(f"{name:<26}{median:>10.2f}{p99:>10.2f}{cached:>11.4f}")
+
+    change_ids = iter(range(1, 10_000_001))
+    new_products = iter(range(count + 1, count + 100_001))
+    product = count // 2
+
+    def change(product_id, stock, category_id=3, seller_id=10, price=99.0):
+        snapshot.apply_changes([Change(next(change_ids), product_id, category_id, seller_id, price, stock)])
+
+    print()
+    print(f"{'change':<26}{'median ms':>10}{'p99 ms':>10}")
+    change(product, 50)
+    median, p99 = timed(lambda: change(product, 40), 1000)
+    print(f"{'stock, stays in stock':<26}{median:>10.3f}{p99:>10.3f}")
+    median, p99 = timed(lambda: change(product, 0), 1000)
+    print(f"{'stock to zero':<26}{median:>10.3f}{p99:>10.3f}")
+    median, p99 = timed(lambda: change(next(new_products), 5), 1000)
+    print(f"{'new product':<26}{median:>10.3f}{p99:>10.3f}")
+
+    # A checkout a millisecond, as the feed would apply them, while queries run
+    stop = threading.Event()
+
+    def checkouts():
+        stock = 10 ** 6
+        while not stop.is_set():
+            stock -= 1
+            change(product, stock)
+            time.sleep(0.001)
+
+    writer = threading.Thread(target=checkouts)
+    writer.start()
+    print()
+    print(f"{'during checkouts':<26}{'median ms':>10}{'p99 ms':>10}{'cached ms':>11}")
+    for name, filters in QUERIES.items():
+        def uncached():
+            snapshot._results.clear()
+            snapshot.facet_counts(**filters)
+        median, p99 = timed(uncached, 50)
+        cached, _ = timed(lambda: snapshot.facet_counts(**filters), 1000)
+        print(f"{name:<26}{median:>10.2f}{p99:>10.2f}{cached:>11.4f}")
+    stop.set()
+    writer.join()
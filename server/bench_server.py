@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# Startup time and throughput of the gunicorn launcher.
+#
+# Starts `gunicorn app:app` with the given number of workers, times how long
+# it takes until the first request is answered, then keeps CONNECTIONS
+# clients busy on the catalog routes for DURATION seconds.
+#
+#     python bench_server.py [workers] [duration_seconds]
+
+# Standard library imports
+import http.client
+import os
+import subprocess
+import sys
+import threading
+import time
+
+PORT = 5599
+CONNECTIONS = 8
+PATHS = ('/categories/summary', '/products', '/products/facets', '/categories/products')
+
+
+def wait_until_up(deadline):
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', PORT, timeout=1)
+            connection.request('GET', '/')
+            if connection.getresponse().status == 200:
+                return True
+        except OSError:
+            time.sleep(0.02)
+    return False
+
+
+def client(stop, counts, index):
+    connection = http.client.HTTPConnection('127.0.0.1', PORT, timeout=10)
+    done = 0
+    while not stop.is_set():
+        try:
+            connection.request('GET', PATHS[done % len(PATHS)])
+            response = connection.getresponse()
+            response.read()
+        except ConnectionError:
+            # A recycled worker drops its keep-alive connections; the next request reconnects
+            connection.close()
+            continue
+        done += 1
+    counts[index] = done
+
+
+if __name__ == '__main__':
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    env = dict(os.environ, BIND=f"127.0.0.1:{PORT}", WEB_CONCURRENCY=str(workers), LOG_LEVEL='warning')
+    start = time.monotonic()
+    server = subprocess.Popen(['gunicorn', 'app:app'], env=env)
+    try:
+        if not wait_until_up(start + 60):
+            sys.exit("Server did not start")
+        startup = time.monotonic() - start
+
+        stop = threading.Event()
+        counts = [0] * CONNECTIONS
+        threads = [threading.Thread(target=client, args=(stop, counts, i)) for i in range(CONNECTIONS)]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        total = sum(counts) / duration
+        print(f"Workers:           {workers} (on {os.cpu_count()} CPUs)")
+        print(f"Startup:           {startup:.2f} s to first response")
+        print(f"Throughput:        {total:.0f} req/s over {', '.join(PATHS)}")
+        print(f"Per core:          {total / min(workers, os.cpu_count()):.0f} req/s")
+    finally:
+        server.terminate()
+        server.wait()
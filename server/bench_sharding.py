@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+# Cart and checkout throughput through the routes, with customer shards off
+# and with 2, 4 ... shards.
+#
+# For each shard count a throwaway instance directory gets a small catalog
+# and CUSTOMERS customers. WORKERS processes, standing in for gunicorn
+# workers, then run POST /cart followed by POST /orders through the test
+# client for random customers of their own, for DURATION seconds.
+#
+#     python bench_sharding.py [max_shards] [duration_seconds]
+
+# Standard library imports
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+WORKERS = 4
+CUSTOMERS = 4000
+PRODUCTS = 200
+
+
+def _app(directory, shards):
+    # The app must be configured before app.py binds the database
+    from config import app
+    app.instance_path = directory
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{directory}/app.db", CUSTOMER_SHARDS=shards)
+    from app import app
+    return app
+
+
+def seed(directory, shards):
+    from sqlalchemy import insert
+
+    # Seeded unsharded, then spread over the shards as an operator would
+    app = _app(directory, 0)
+    from config import db
+    from models import Category, Customer, Product, Seller, User
+    import sharding
+
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(User), [{'id': 1, 'username': 'seller', 'password': '-', 'role': 'seller'}] + [
+            {'id': 1 + id, 'username': f'customer{id}', 'password': '-', 'role': 'customer'}
+            for id in range(1, CUSTOMERS + 1)])
+        db.session.execute(insert(Seller).values(id=1, user_id=1, business_name='Seller', status='approved',
+                                                 business_email='seller@example.com', business_address='-'))
+        db.session.execute(insert(Customer), [
+            {'id': id, 'user_id': 1 + id, 'name': f'Customer {id}', 'email': f'customer{id}@example.com',
+             'address': '-', 'phone_no': 700000000 + id} for id in range(1, CUSTOMERS + 1)])
+        db.session.execute(insert(Category).values(id=1, name='Category'))
+        db.session.execute(insert(Product), [
+            {'id': id, 'seller_id': 1, 'category_id': 1, 'name': f'Product {id}', 'description': '-',
+             'price': 9.99, 'stock': 10 ** 9} for id in range(1, PRODUCTS + 1)])
+        db.session.commit()
+        sharding.reshard(shards)
+
+
+def worker(directory, shards, number, duration, results):
+    app = _app(directory, shards)
+    from flask_jwt_extended import create_access_token
+
+    # Each worker has customers of its own, as with sticky sessions
+    customers = range(1 + number, CUSTOMERS + 1, WORKERS)
+    with app.app_context():
+        tokens = {id: create_access_token(identity={'id': 1 + id, 'role': 'customer'}) for id in customers}
+    client = app.test_client()
+    counts = {'cart': 0, 'orders': 0, 'failed': 0}
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        headers = {'Authorization': f"Bearer {tokens[random.choice(customers)]}"}
+        for product_id in random.sample(range(1, PRODUCTS + 1), 2):
+            response = client.post('/cart', headers=headers, json={'productId': product_id, 'quantity': 1})
+            counts['cart' if response.status_code == 201 else 'failed'] += 1
+        response = client.post('/orders', headers=headers)
+        counts['orders' if response.status_code == 201 else 'failed'] += 1
+    results.put(counts)
+
+
+def run(shards, duration):
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directory:
+        process = context.Process(target=seed, args=(directory, shards))
+        process.start()
+        process.join()
+
+        results = context.Queue()
+        processes = [context.Process(target=worker, args=(directory, shards, number, duration, results))
+                     for number in range(WORKERS)]
+        for process in processes:
+            process.start()
+        totals = {'cart': 0, 'orders': 0, 'failed': 0}
+        for _ in processes:
+            for name, count in results.get().items():
+                totals[name] += count
+        for process in processes:
+            process.join()
+    return {name: count / duration for name, count in totals.items()}
+
+
+if __name__ == '__main__':
+    max_shards = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    print(f"{WORKERS} worker processes on {os.cpu_count()} CPUs, two POST /cart per POST /orders")
+    print(f"{'shards':>6}{'cart/s':>10}{'orders/s':>10}{'failed/s':>10}{'speed-up':>10}")
+    baseline = None
+    shards = 0
+    while shards <= max_shards:
+        rates = run(shards, duration)
+        baseline = baseline or rates['orders']
+        print(f"{shards:>6}{rates['cart']:>10.0f}{rates['orders']:>10.0f}{rates['failed']:>10.1f}"
+              f"{rates['orders'] / baseline:>9.2f}x")
+        shards = shards * 2 if shards else 2
@@ -0,0 +1,364 @@
+# Where live carts are kept, chosen by CART_STORE:
+#
+#   'database'  every cart change is its own transaction on the cart table,
+#               together with the stock hold (the default)
+#   'memory'    carts live in this worker's memory and are written behind
+#   'kv'        as 'memory', through a stand-in for a shared key-value store
+#               with a Redis-style API; pass a redis.Redis client as `kv` to
+#               WriteBehindCartStore to share carts between workers
+#
+# Write-behind: a cart change only touches the live cart and marks the
+# customer dirty. A flusher thread in each worker writes every dirty cart to
+# the cart table, and resizes or releases its stock holds, every
+# CART_FLUSH_INTERVAL_SECONDS in transactions of CART_FLUSH_BATCH_SIZE
+# customers. Checkout flushes the customer's cart first, so orders are always
+# placed from the latest cart. Adding still checks available stock, but that
+# is a read: no write transaction is left on the add or remove path.
+#
+# Crash safety of the write-behind stores:
+#
+# - The cart table is never more than one flush behind. A worker killed
+#   without a graceful shutdown (SIGKILL, OOM) loses the cart changes made in
+#   its last interval; a graceful shutdown, including gunicorn recycling a
+#   worker, flushes at exit.
+# - A flush commits each batch (per customer shard, see sharding.py) whole or
+#   not at all. A failed batch is marked dirty again and retried next cycle.
+# - Customers are taken off the dirty set before their carts are read, so a
+#   change made while a flush runs is either in that flush or in the next.
+# - Checkout waits for a flush that is already writing the customer's cart,
+#   which may have read it before the last change, before flushing it
+#   itself. The wait covers this worker's flusher only: with a store shared
+#   between workers, the customer's cart may be mid-flush in another worker
+#   and the checkout UPDATE guard is what remains.
+# - Stock holds lag the live cart by up to one interval. Two customers may
+#   both add the last unit within that window; the checkout UPDATE is guarded
+#   on stock either way, so the later checkout gets a 409 and nothing is
+#   oversold. Holds of lost changes simply expire.
+# - A live cart that is idle for CART_STORE_TTL_SECONDS is dropped and read
+#   back from the cart table on next use. The TTL must stay far above the
+#   flush interval so a dirty cart is always written before it expires.
+# - 'memory' and the in-process 'kv' stand-in hold carts per worker. Run them
+#   with a single worker (or sticky sessions); otherwise use 'database' or a
+#   real shared store.
+#
+# With a write-behind store, cart line ids are product ids, since a line may
+# not have a cart row yet. DELETE /cart/<id> takes the ids handed out by the
+# same store.
+
+# Standard library imports
+import atexit
+import threading
+import time
+from collections import namedtuple
+
+# Remote library imports
+from sqlalchemy import delete, tuple_
+from sqlalchemy.dialects.sqlite import insert
+
+# Local imports
+from config import app, db
+from models import Cart, Reservation
+import reservations
+import sharding
+
+CartLine = namedtuple('CartLine', ['id', 'product_id', 'quantity'])
+
+DIRTY_KEY = 'carts:dirty'
+# Present in every live cart, so an empty cart isn't taken for an expired one
+LOADED_FIELD = '_loaded'
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+class DatabaseCartStore:
+    """Carts in the cart table, written through. The caller commits."""
+
+    def lines(self, customer_id):
+        return [CartLine(item.id, item.product_id, item.quantity)
+                for item in Cart.query.filter_by(customer_id=customer_id).order_by(Cart.id)]
+
+    def add(self, customer_id, product_id, quantity):
+        """Add to a line and hold its stock. Returns the line, or None when stock is short."""
+        cart_item = Cart.query.filter_by(customer_id=customer_id, product_id=product_id).first()
+        wanted = quantity + (cart_item.quantity if cart_item else 0)
+        if not reservations.reserve(customer_id, product_id, wanted):
+            return None
+        # The hold is in app.db and the cart row on the customer's shard: app.db is written first (see sharding.py)
+        db.session.flush()
+
+        if cart_item:
+            cart_item.quantity = wanted
+        else:
+            cart_item = Cart(customer_id=customer_id, product_id=product_id, quantity=quantity)
+            db.session.add(cart_item)
+        db.session.flush()
+        return CartLine(cart_item.id, product_id, wanted)
+
+    def remove(self, customer_id, line_id):
+        """Drop a line and its hold. Returns False if the customer has no such line."""
+        cart_item = Cart.query.filter_by(id=line_id, customer_id=customer_id).first()
+        if not cart_item:
+            return False
+        reservations.release(customer_id, cart_item.product_id)
+        db.session.delete(cart_item)
+        return True
+
+    def flush(self, customer_ids=None):
+        pass
+
+    def clear(self, customer_id):
+        pass
+
+
+class MemoryKV:
+    """Per-process key-value store with the few Redis hash and set commands used here."""
+
+    def __init__(self):
+        self._hashes = {}  # key -> (fields, expires_at)
+        self._sets = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        entry = self._hashes.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self._hashes[key]
+            return None
+        return entry
+
+    def _sweep(self):
+        # Drop idle carts; called from spop, which the flusher runs every cycle
+        now = time.monotonic()
+        for key in [key for key, (_, expires_at) in self._hashes.items()
+                    if expires_at is not None and expires_at <= now]:
+            del self._hashes[key]
+
+    def _encode(self, value):
+        return value
+
+    def hgetall(self, key):
+        with self._lock:
+            entry = self._live(key)
+            return dict(entry[0]) if entry else {}
+
+    def hset(self, key, mapping):
+        with self._lock:
+            entry = self._live(key)
+            fields, expires_at = entry if entry else ({}, None)
+            fields.update({self._encode(k): self._encode(v) for k, v in mapping.items()})
+            self._hashes[key] = (fields, expires_at)
+
+    def hdel(self, key, *names):
+        with self._lock:
+            entry = self._live(key)
+            if not entry:
+                return 0
+            return sum(entry[0].pop(self._encode(name), None) is not None for name in names)
+
+    def expire(self, key, seconds):
+        with self._lock:
+            entry = self._live(key)
+            if entry:
+                self._hashes[key] = (entry[0], time.monotonic() + seconds)
+
+    def delete(self, key):
+        with self._lock:
+            self._hashes.pop(key, None)
+
+    def sadd(self, key, *members):
+        with self._lock:
+            self._sets.setdefault(key, set()).update(self._encode(member) for member in members)
+
+    def srem(self, key, *members):
+        with self._lock:
+            members = {self._encode(member) for member in members}
+            found = self._sets.get(key, set()) & members
+            self._sets.get(key, set()).difference_update(found)
+            return len(found)
+
+    def spop(self, key, count):
+        with self._lock:
+            self._sweep()
+            members = self._sets.get(key, set())
+            return [members.pop() for _ in range(min(count, len(members)))]
+
+
+class KeyValueStandIn(MemoryKV):
+    """MemoryKV that stores and returns bytes, as a networked store such as Redis does."""
+
+    def _encode(self, value):
+        return value if isinstance(value, bytes) else str(value).encode()
+
+
+class WriteBehindCartStore:
+    """Live carts in a key-value store, flushed to the cart table in batches."""
+
+    def __init__(self, kv):
+        self.kv = kv
+        self._flusher = None
+        self._flusher_lock = threading.Lock()
+        # Customers whose carts a flush has taken off the dirty set and not written yet
+        self._in_flight = set()
+        self._in_flight_changed = threading.Condition()
+
+    @staticmethod
+    def _key(customer_id):
+        return f"cart:{customer_id}"
+
+    def _read(self, customer_id):
+        # {product_id: quantity}, or None when the cart is not in the store
+        fields = {_text(k): int(v) for k, v in self.kv.hgetall(self._key(customer_id)).items()}
+        if LOADED_FIELD not in fields:
+            return None
+        del fields[LOADED_FIELD]
+        return {int(product_id): quantity for product_id, quantity in fields.items()}
+
+    def _load(self, customer_id):
+        cart = self._read(customer_id)
+        if cart is None:
+            cart = {item.product_id: item.quantity for item in Cart.query.filter_by(customer_id=customer_id)}
+            self.kv.hset(self._key(customer_id), mapping={LOADED_FIELD: 1, **cart})
+        self.kv.expire(self._key(customer_id), app.config['CART_STORE_TTL_SECONDS'])
+        return cart
+
+    def _changed(self, customer_id):
+        self.kv.sadd(DIRTY_KEY, customer_id)
+        self._start_flusher()
+
+    def lines(self, customer_id):
+        return [CartLine(product_id, product_id, quantity)
+                for product_id, quantity in sorted(self._load(customer_id).items())]
+
+    def add(self, customer_id, product_id, quantity):
+        """Add to a line if enough stock is unheld. Returns the line, or None when stock is short."""
+        wanted = quantity + self._load(customer_id).get(product_id, 0)
+        if reservations.available_stock(product_id, exclude_customer_id=customer_id) < wanted:
+            return None
+        self.kv.hset(self._key(customer_id), mapping={product_id: wanted})
+        self._changed(customer_id)
+        return CartLine(product_id, product_id, wanted)
+
+    def remove(self, customer_id, line_id):
+        if line_id not in self._load(customer_id):
+            return False
+        self.kv.hdel(self._key(customer_id), line_id)
+        self._changed(customer_id)
+        return True
+
+    def clear(self, customer_id):
+        """Empty the live cart after checkout has deleted the cart rows."""
+        self.kv.delete(self._key(customer_id))
+        self.kv.hset(self._key(customer_id), mapping={LOADED_FIELD: 1})
+        self.kv.expire(self._key(customer_id), app.config['CART_STORE_TTL_SECONDS'])
+
+    def flush(self, customer_ids=None):
+        """Write dirty carts to the cart table: those given, or every dirty cart."""
+        if customer_ids is not None:
+            with self._in_flight_changed:
+                self._in_flight_changed.wait_for(lambda: self._in_flight.isdisjoint(customer_ids))
+                customer_ids = [id for id in customer_ids if self.kv.srem(DIRTY_KEY, id)]
+                self._in_flight.update(customer_ids)
+            if customer_ids:
+                self._write(customer_ids)
+            return
+
+        batch_size = app.config['CART_FLUSH_BATCH_SIZE']
+        while True:
+            # Taken off the dirty set and marked in flight at once, so a checkout sees one or the other
+            with self._in_flight_changed:
+                customer_ids = [int(_text(id)) for id in self.kv.spop(DIRTY_KEY, batch_size)]
+                self._in_flight.update(customer_ids)
+            if not customer_ids:
+                return
+            self._write(customer_ids)
+
+    def _write(self, customer_ids):
+        # Takes customers marked in flight and always unmarks them
+        groups = list(sharding.group_by_shard(customer_ids).items())
+        try:
+            for position, (index, shard_customer_ids) in enumerate(groups):
+                try:
+                    with sharding.using_shard(index):
+                        self._write_shard(shard_customer_ids)
+                except Exception:
+                    self.kv.sadd(DIRTY_KEY, *(id for _, ids in groups[position:] for id in ids))
+                    raise
+        finally:
+            with self._in_flight_changed:
+                self._in_flight.difference_update(customer_ids)
+                self._in_flight_changed.notify_all()
+
+    def _write_shard(self, customer_ids):
+        try:
+            carts = {id: cart for id in customer_ids if (cart := self._read(id)) is not None}
+            stored = Cart.query.filter(Cart.customer_id.in_(carts)).all() if carts else []
+            rows = {(item.customer_id, item.product_id): item for item in stored}
+
+            holds, added, resized = [], [], []
+            for customer_id, cart in carts.items():
+                for product_id, quantity in cart.items():
+                    item = rows.pop((customer_id, product_id), None)
+                    if item is None:
+                        added.append(Cart(customer_id=customer_id, product_id=product_id, quantity=quantity))
+                    elif item.quantity != quantity:
+                        resized.append((item, quantity))
+                    holds.append({'customer_id': customer_id, 'product_id': product_id, 'quantity': quantity,
+                                  'expires_at': reservations.reservation_expiry()})
+
+            # Holds (app.db) before cart rows (the shard), the order every transaction writes them in
+            if rows:
+                db.session.execute(delete(Reservation).where(
+                    tuple_(Reservation.customer_id, Reservation.product_id).in_(list(rows))
+                ))
+            for start in range(0, len(holds), 2000):
+                statement = insert(Reservation).values(holds[start:start + 2000])
+                db.session.execute(statement.on_conflict_do_update(
+                    index_elements=['customer_id', 'product_id'],
+                    set_={'quantity': statement.excluded.quantity, 'expires_at': statement.excluded.expires_at},
+                ))
+            for item in rows.values():
+                db.session.delete(item)
+            for item, quantity in resized:
+                item.quantity = quantity
+            db.session.add_all(added)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def _start_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._flusher_lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+                self._flusher.start()
+                atexit.register(self._flush_at_exit)
+
+    def _flush_loop(self):
+        interval = app.config['CART_FLUSH_INTERVAL_SECONDS']
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception:
+                app.logger.exception("Flushing carts failed, retrying in %ss", interval)
+
+    def _flush_at_exit(self):
+        with app.app_context():
+            self.flush()
+
+
+def make_store(kind):
+    if kind == 'database':
+        return DatabaseCartStore()
+    if kind == 'memory':
+        return WriteBehindCartStore(MemoryKV())
+    if kind == 'kv':
+        return WriteBehindCartStore(KeyValueStandIn())
+    raise ValueError(f"Unknown CART_STORE {kind!r}")
+
+
+store = make_store(app.config['CART_STORE'])
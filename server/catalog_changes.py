@@ -0,0 +1,251 @@
+# Stock and price changes pushed to clients over server-sent events
+# (GET /catalog/changes), so they fetch the catalog once instead of polling it.
+#
+# Product writes (add_product, PATCH /seller/products and checkout) call
+# record() inside their own transaction, adding one catalog_change row per
+# product and pruning the table to the last CATALOG_CHANGES_LOG_SIZE rows.
+# SQLite admits one writer at a time, so row ids follow commit order and serve
+# as event ids; being a table, the log is shared by every gunicorn worker.
+#
+# Each worker runs one feed thread that reads new rows every
+# CATALOG_CHANGES_POLL_SECONDS (at once after the worker's own writes) into a
+# deque of the same size and wakes the open streams. Streams never query the
+# database, so however many a worker serves, they cost one query per poll.
+# The same rows keep the worker's facet snapshot current (catalog_snapshot.py).
+# Events carry absolute values, not deltas:
+#
+#     id: 1234
+#     data: {"id":17,"category_id":3,"stock":4,"price":19.99}
+#
+# A client fetches the catalog (GET /categories/products), which may be a
+# cached copy up to SINGLEFLIGHT_TTL_SECONDS + SINGLEFLIGHT_STALE_SECONDS old,
+# and opens the stream from the X-Catalog-Change-Id it came with: the last
+# change logged before the catalog was read. The stream replays every change
+# after it; one the catalog already reflects just writes the same values
+# again. Browsers reconnect with a Last-Event-ID header and the stream
+# replays what they missed. An id newer than the worker's feed makes the
+# stream read the log at once rather than wait for the next poll. When the
+# id is older than anything left in the log, or was never logged, the stream
+# sends `event: reset` and the client fetches the catalog again.
+#
+# A stream closes after CATALOG_STREAM_MAX_SECONDS, below gunicorn's worker
+# timeout, and the client reconnects after CATALOG_STREAM_RETRY_MS. A worker
+# serves at most CATALOG_STREAM_MAX_CLIENTS streams and answers more with 503
+# and Retry-After. In production the streams have their own server
+# (gunicorn_streams.conf.py), whose gevent workers hold one greenlet per
+# stream and take thousands each. The API's threaded workers serve the route
+# too, as a fallback: there each stream holds a thread, so they take only a
+# few and keep the rest for the API. A client that goes away is noticed when
+# a write to it fails, at a heartbeat, so its slot is held that long at most.
+
+# Standard library imports
+import json
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from itertools import takewhile
+
+# Remote library imports
+from sqlalchemy import delete, func, insert, select
+
+# Local imports
+from config import app, db
+from models import CatalogChange
+
+Change = namedtuple('Change', ['id', 'category_id', 'data'])
+
+
+def record(products):
+    """Log the new stock and price of products written in the current transaction;
+    each product has id, category_id, seller_id, price and stock. The caller commits."""
+    if not products:
+        return
+    db.session.execute(insert(CatalogChange), [
+        {'product_id': product['id'], 'category_id': product['category_id'],
+         'seller_id': product['seller_id'], 'price': product['price'], 'stock': product['stock']}
+        for product in products
+    ])
+    db.session.execute(
+        delete(CatalogChange)
+        .where(CatalogChange.id <= select(func.max(CatalogChange.id)).scalar_subquery()
+               - app.config['CATALOG_CHANGES_LOG_SIZE'])
+        .execution_options(synchronize_session=False)
+    )
+
+
+def current_id():
+    """Id of the newest logged change. Read it before the catalog data it goes with."""
+    return db.session.execute(select(func.coalesce(func.max(CatalogChange.id), 0))).scalar()
+
+
+class ChangeFeed:
+    def __init__(self, size):
+        self.last_id = 0
+        self._changes = deque(maxlen=size)
+        self._condition = threading.Condition()
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self._listeners = []
+
+    def listen(self, callback):
+        """Call `callback` with the catalog_change rows of every poll, in id order."""
+        self._listeners.append(callback)
+
+    @contextmanager
+    def paused(self):
+        """Hold back polls, so no rows reach the listeners meanwhile."""
+        with self._poll_lock:
+            yield
+
+    def _poll(self):
+        # The feed thread and catch_up() poll; one at a time, or both would append the same rows
+        with self._poll_lock:
+            rows = self._read_new()
+            if rows:
+                for callback in self._listeners:
+                    callback(rows)
+
+    def _read_new(self):
+        # The newest rows after the last one seen, at most a deque's worth:
+        # whatever the deque holds is then always a gapless run up to last_id
+        rows = db.session.execute(
+            select(CatalogChange.id, CatalogChange.product_id, CatalogChange.category_id,
+                   CatalogChange.seller_id, CatalogChange.price, CatalogChange.stock)
+            .where(CatalogChange.id > self.last_id)
+            .order_by(CatalogChange.id.desc())
+            .limit(self._changes.maxlen)
+        ).all()[::-1]
+        if not rows:
+            return rows
+        with self._condition:
+            self._changes.extend(
+                Change(row.id, row.category_id, json.dumps(
+                    {'id': row.product_id, 'category_id': row.category_id, 'stock': row.stock,
+                     'price': row.price}, separators=(',', ':')))
+                for row in rows
+            )
+            self.last_id = rows[-1].id
+            self._condition.notify_all()
+        return rows
+
+    def start(self):
+        """Catch up with the log and start the feed thread, once per worker."""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._poll()
+                thread = threading.Thread(target=self._poll_loop, daemon=True)
+                thread.start()
+                self._thread = thread
+
+    def stop(self):
+        """Stop the feed thread; start() begins a new one. The gunicorn master
+        calls it after warm-up, as a thread does not survive a fork."""
+        with self._start_lock:
+            if self._thread is None:
+                return
+            self._stopping = True
+            self._wake.set()
+            self._thread.join()
+            self._stopping = False
+            self._thread = None
+
+    def _poll_loop(self):
+        interval = app.config['CATALOG_CHANGES_POLL_SECONDS']
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            if self._stopping:
+                return
+            try:
+                with app.app_context():
+                    self._poll()
+            except Exception:
+                app.logger.exception("Reading catalog changes failed, retrying in %ss", interval)
+
+    def poke(self):
+        """Read new changes now instead of at the next poll. Call after committing a write."""
+        if self._thread is not None:
+            self._wake.set()
+
+    def catch_up(self, last_id):
+        """Read the log now if `last_id` is newer than the feed: ids come from
+        current_id(), which reads the table, while the feed lags it by up to a poll."""
+        if last_id > self.last_id:
+            self._poll()
+
+    def changes_after(self, last_id):
+        """Changes after `last_id` in id order, or None when some have been
+        pruned or `last_id` was never logged. Call catch_up() first."""
+        with self._condition:
+            if last_id > self.last_id or (self._changes and last_id < self._changes[0].id - 1):
+                return None
+            return list(takewhile(lambda change: change.id > last_id, reversed(self._changes)))[::-1]
+
+    def wait(self, last_id, timeout):
+        """Block until there are changes after `last_id`; False on timeout."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self.last_id > last_id, timeout)
+
+
+feed = ChangeFeed(app.config['CATALOG_CHANGES_LOG_SIZE'])
+# Streams this worker may serve at once
+_stream_slots = threading.BoundedSemaphore(app.config['CATALOG_STREAM_MAX_CLIENTS'])
+
+
+def stream_closed():
+    """Give back the slot of a stream returned by stream(). Call when its response closes."""
+    _stream_slots.release()
+
+
+def stream(last_id, category_ids):
+    """Start the feed and return a generator of event-stream text for one
+    client: changes after `last_id` (None for from now on), optionally only
+    those in `category_ids`. Returns None when the worker already serves
+    CATALOG_STREAM_MAX_CLIENTS streams."""
+    if not _stream_slots.acquire(blocking=False):
+        return None
+    try:
+        feed.start()
+    except Exception:
+        _stream_slots.release()
+        raise
+    retry_ms = app.config['CATALOG_STREAM_RETRY_MS']
+    heartbeat = app.config['CATALOG_STREAM_HEARTBEAT_SECONDS']
+    max_seconds = app.config['CATALOG_STREAM_MAX_SECONDS']
+    if last_id is None:
+        last_id = feed.last_id
+    else:
+        feed.catch_up(last_id)
+
+    def generate(last_id):
+        # An id with no data moves the client's Last-Event-ID without firing an
+        # event, so changes outside its categories don't count as missed
+        yield f"retry: {retry_ms}\nid: {last_id}\n\n"
+        deadline = time.monotonic() + max_seconds
+        while True:
+            changes = feed.changes_after(last_id)
+            if changes is None:
+                last_id = feed.last_id
+                yield f"event: reset\nid: {last_id}\ndata: {{}}\n\n"
+                continue
+            if changes:
+                last_id = changes[-1].id
+                events = ''.join(f"id: {change.id}\ndata: {change.data}\n\n" for change in changes
+                                 if not category_ids or change.category_id in category_ids)
+                if events:
+                    yield events
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                yield f"id: {last_id}\n\n"
+                return
+            if not feed.wait(last_id, min(heartbeat, remaining)):
+                yield f"id: {last_id}\n\n"
+
+    return generate(last_id)
@@ -0,0 +1,114 @@
+# Filter and sort parameters for GET /products, compiled to one SELECT.
+#
+# Every filter is served by an index: an equality on category_id or
+# seller_id, a range on price, or the partial index of in-stock products.
+# Price sorts walk a price index and stop after LIMIT rows. Newest-first walks
+# the primary key when nothing narrows the rows; with a price range the
+# matching rows are read through the price index and only those are sorted.
+# `q` is a substring match on the name, which no index can serve: alone it
+# reads the whole table, otherwise it is applied on top of the rows an index
+# narrows down. check_query_plans.py verifies this against SQLite's planner.
+
+# Remote library imports
+from sqlalchemy import literal_column, select
+
+# Local imports
+from models import Product
+
+SORTS = {
+    'newest': (Product.id.desc(),),
+    'price_asc': (Product.price.asc(), Product.id.asc()),
+    'price_desc': (Product.price.desc(), Product.id.desc()),
+}
+DEFAULT_LIMIT = 24
+MAX_LIMIT = 100
+MAX_OFFSET = 10000
+
+
+def _int(args, name, errors, minimum=None, maximum=None):
+    value = args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        errors[name] = 'must be an integer'
+        return None
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        errors[name] = f"must be between {minimum} and {maximum}"
+        return None
+    return value
+
+
+def _float(args, name, errors):
+    value = args.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        value = float(value)
+    except ValueError:
+        errors[name] = 'must be a number'
+        return None
+    if value < 0:
+        errors[name] = 'must not be negative'
+        return None
+    return value
+
+
+def parse_product_filters(args):
+    """Validate query-string arguments. Returns (filters, errors)."""
+    errors = {}
+    filters = {
+        'category_id': _int(args, 'category_id', errors, minimum=1),
+        'seller_id': _int(args, 'seller_id', errors, minimum=1),
+        'min_price': _float(args, 'min_price', errors),
+        'max_price': _float(args, 'max_price', errors),
+        'limit': _int(args, 'limit', errors, minimum=1, maximum=MAX_LIMIT) or DEFAULT_LIMIT,
+        'offset': _int(args, 'offset', errors, minimum=0, maximum=MAX_OFFSET) or 0,
+    }
+
+    in_stock = args.get('in_stock', '').lower()
+    if in_stock not in ('', 'true', 'false', '1', '0'):
+        errors['in_stock'] = 'must be true or false'
+    filters['in_stock'] = in_stock in ('true', '1')
+
+    q = args.get('q', '').strip()
+    if q and not 2 <= len(q) <= 100:
+        errors['q'] = 'must be between 2 and 100 characters'
+    filters['q'] = q or None
+
+    sort = args.get('sort', 'newest')
+    if sort not in SORTS:
+        errors['sort'] = f"must be one of {', '.join(SORTS)}"
+    filters['sort'] = sort
+
+    if filters['min_price'] is not None and filters['max_price'] is not None \
+            and filters['min_price'] > filters['max_price']:
+        errors['min_price'] = 'must not be greater than max_price'
+
+    return filters, errors
+
+
+def product_query(filters):
+    """Build the SELECT for validated filters, fetching one extra row to tell if there is a next page."""
+    query = select(Product)
+    if filters['category_id'] is not None:
+        query = query.where(Product.category_id == filters['category_id'])
+    if filters['seller_id'] is not None:
+        query = query.where(Product.seller_id == filters['seller_id'])
+    if filters['min_price'] is not None:
+        query = query.where(Product.price >= filters['min_price'])
+    if filters['max_price'] is not None:
+        query = query.where(Product.price <= filters['max_price'])
+    if filters['in_stock']:
+        # A literal 0, not a bound parameter, so the partial index ix_product_in_stock_id applies
+        query = query.where(Product.stock > literal_column('0'))
+    if filters['q']:
+        escaped = filters['q'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = query.where(Product.name.ilike(f"%{escaped}%", escape='\\'))
+    order_by = SORTS[filters['sort']]
+    if filters['sort'] == 'newest' and (filters['min_price'] is not None or filters['max_price'] is not None):
+        # `id + 0` stops SQLite from walking every product in id order to skip the sort;
+        # it narrows by the price index instead and sorts just the matching rows
+        order_by = ((Product.id + 0).desc(),)
+    return query.order_by(*order_by).limit(filters['limit'] + 1).offset(filters['offset'])
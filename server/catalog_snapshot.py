@@ -0,0 +1,270 @@
+# In-memory columnar copy of the product catalog for facet counts.
+#
+# Each worker keeps the columns the facet sidebar needs (id, category_id,
+# seller_id, price, stock) in NumPy arrays ordered by product id, and answers
+# facet queries with vectorized masks and bincount instead of SQL aggregates.
+#
+# The snapshot is loaded once and then kept current from the catalog_change
+# log: the worker's change feed (catalog_changes.py) hands it every row it
+# reads, from any worker, within CATALOG_CHANGES_POLL_SECONDS (at once after
+# the worker's own writes). `version` is the id of the last change applied,
+# so every worker reports the same version for the same catalog state, and
+# clients can match it against the ids of the change stream. A gap in the
+# ids means the feed skipped rows, and the snapshot is loaded again.
+#
+# Counts are computed outside the lock, so a slow query doesn't hold up other
+# queries or the feed. While a query runs, the feed writes to copies of the
+# columns it changes instead of the arrays being read (copy-on-write).
+# Results are reused until a change moves a product between facets; most
+# checkouts only lower stock that stays above zero and keep them.
+#
+# bench_catalog_snapshot.py measures memory and latency at 1M products.
+
+# Standard library imports
+import threading
+
+# Remote library imports
+import numpy as np
+from sqlalchemy import func, select
+
+# Local imports
+from config import app, db
+from models import CatalogChange, Product
+import catalog_changes
+
+# Counted columns are intp, which bincount takes without converting a copy first
+COLUMNS = (
+    ('id', np.int64),
+    ('category_id', np.intp),
+    ('seller_id', np.intp),
+    ('price', np.float64),
+    ('stock', np.int32),
+)
+
+
+class CatalogSnapshot:
+    def __init__(self, price_buckets):
+        self.price_buckets = np.asarray(price_buckets, dtype=np.float64)
+        self.version = 0
+        self.loaded = False
+        self._lock = threading.Lock()
+        self._size = 0
+        self._columns = {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS}
+        self._columns['price_bucket'] = np.empty(0, dtype=np.intp)
+        # Queries computing right now, and the columns they may be reading
+        self._readers = 0
+        self._shared = set()
+        # Facet results, keyed by filters; many users ask for the same ones.
+        # `_generation` moves on whenever a change makes them wrong
+        self._results = {}
+        self._generation = 0
+
+    def _bucket(self, prices):
+        # Index of the price bucket each price falls in, computed once per write rather than per query.
+        # Prices outside the edges (a negative price, say) count in the first or last bucket
+        index = np.searchsorted(self.price_buckets, prices, side='right') - 1
+        return np.clip(index, 0, len(self.price_buckets) - 2).astype(np.intp)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self._columns.values())
+
+    def load_arrays(self, ids, category_ids, seller_ids, prices, stocks, version=0):
+        """Replace the whole snapshot. `ids` must be sorted ascending."""
+        columns = {
+            'id': np.asarray(ids, dtype=np.int64),
+            'category_id': np.asarray(category_ids, dtype=np.intp),
+            'seller_id': np.asarray(seller_ids, dtype=np.intp),
+            'price': np.asarray(prices, dtype=np.float64),
+            'stock': np.asarray(stocks, dtype=np.int32),
+        }
+        columns['price_bucket'] = self._bucket(columns['price'])
+        with self._lock:
+            self._columns = columns
+            self._size = len(columns['id'])
+            self._shared.clear()
+            self.version = version
+            self.loaded = True
+            self._invalidate()
+
+    def _invalidate(self):
+        self._generation += 1
+        self._results.clear()
+
+    def load(self, session):
+        # Read the change id first: changes after it are applied again on top, which is
+        # harmless as they carry absolute values
+        version = session.execute(select(func.coalesce(func.max(CatalogChange.id), 0))).scalar()
+        rows = session.execute(
+            select(Product.id, Product.category_id, Product.seller_id, Product.price, Product.stock)
+            .order_by(Product.id)
+        ).all()
+        self.load_arrays(*(zip(*rows) if rows else ([],) * len(COLUMNS)), version=version)
+
+    def _writable(self, *names):
+        # Copy columns a running query may be reading before writing to them
+        for name in self._shared.intersection(names):
+            self._columns[name] = self._columns[name].copy()
+            self._shared.discard(name)
+
+    def _grow(self, needed):
+        capacity = len(self._columns['id'])
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+        self._shared.clear()
+
+    def _apply(self, change):
+        # Returns whether the change moves the product between facets
+        ids = self._columns['id'][:self._size]
+        position = int(np.searchsorted(ids, change.product_id))
+        if position == self._size or ids[position] != change.product_id:
+            if position != self._size or change.seller_id is None:
+                # Ids are handed out in increasing order and new rows carry the seller, so
+                # this only happens for changes logged before the seller was
+                self.loaded = False
+                return False
+            self._grow(self._size + 1)
+            columns = self._columns
+            columns['id'][position] = change.product_id
+            columns['seller_id'][position] = change.seller_id
+            columns['category_id'][position] = change.category_id
+            columns['price'][position] = change.price
+            columns['price_bucket'][position] = self._bucket(change.price)
+            columns['stock'][position] = change.stock
+            self._size += 1
+            return True
+
+        columns = self._columns
+        if (columns['category_id'][position] == change.category_id
+                and columns['price'][position] == change.price
+                and (columns['stock'][position] > 0) == (change.stock > 0)):
+            self._writable('stock')
+            self._columns['stock'][position] = change.stock
+            return False
+        self._writable('category_id', 'price', 'price_bucket', 'stock')
+        columns = self._columns
+        columns['category_id'][position] = change.category_id
+        columns['price'][position] = change.price
+        columns['price_bucket'][position] = self._bucket(change.price)
+        columns['stock'][position] = change.stock
+        return True
+
+    def apply_changes(self, changes):
+        """Apply catalog_change rows (product_id, category_id, seller_id, price, stock), in id order."""
+        with self._lock:
+            if not self.loaded:
+                return
+            moved = False
+            for change in changes:
+                if change.id <= self.version:
+                    continue
+                if change.id != self.version + 1:
+                    self.loaded = False
+                    break
+                moved = self._apply(change) or moved
+                if not self.loaded:
+                    break
+                self.version = change.id
+            if moved:
+                self._invalidate()
+
+    def facet_counts(self, category_id=None, seller_id=None, min_price=None, max_price=None, in_stock=False):
+        """Counts per category, seller and price bucket for the given filters.
+
+        Each facet is counted with every filter except its own applied, so
+        picking a category still shows how many products the other
+        categories would have.
+        """
+        key = (category_id, seller_id, min_price, max_price, bool(in_stock))
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                return {'version': self.version, **result}
+            size = self._size
+            columns = {name: column[:size] for name, column in self._columns.items()}
+            version, generation = self.version, self._generation
+            self._readers += 1
+            self._shared.update(self._columns)
+
+        try:
+            result = self._count(columns, category_id, seller_id, min_price, max_price, in_stock)
+        finally:
+            with self._lock:
+                self._readers -= 1
+                if not self._readers:
+                    self._shared.clear()
+                if generation == self._generation:
+                    if len(self._results) >= 256:
+                        self._results.clear()
+                    self._results[key] = result
+        return {'version': version, **result}
+
+    def _count(self, columns, category_id, seller_id, min_price, max_price, in_stock):
+        category = columns['category_id']
+        seller = columns['seller_id']
+        price = columns['price']
+        price_bucket = columns['price_bucket']
+
+        # Products are never removed from the catalog, so only stock narrows the base set
+        base = columns['stock'] > 0 if in_stock else None
+        by_category = category == category_id if category_id is not None else None
+        by_seller = seller == seller_id if seller_id is not None else None
+        by_price = None
+        if min_price is not None:
+            by_price = price >= min_price
+        if max_price is not None:
+            by_price = price <= max_price if by_price is None else by_price & (price <= max_price)
+
+        def combine(*masks):
+            mask = base
+            for other in masks:
+                if other is not None:
+                    mask = other if mask is None else mask & other
+            return mask
+
+        def selected(column, mask):
+            return column if mask is None else column[mask]
+
+        category_mask = combine(by_seller, by_price)
+        seller_mask = combine(by_category, by_price)
+        price_mask = combine(by_category, by_seller)
+        total_mask = combine(by_category, by_seller, by_price)
+
+        edges = self.price_buckets
+        categories = np.bincount(selected(category, category_mask))
+        sellers = np.bincount(selected(seller, seller_mask))
+        histogram = np.bincount(selected(price_bucket, price_mask), minlength=len(edges) - 1)
+
+        return {
+            'total': len(category) if total_mask is None else int(np.count_nonzero(total_mask)),
+            'categories': {int(key): int(count) for key, count in enumerate(categories) if count},
+            'sellers': {int(key): int(count) for key, count in enumerate(sellers) if count},
+            'price_buckets': [
+                {'min': float(edges[i]), 'max': None if np.isinf(edges[i + 1]) else float(edges[i + 1]),
+                 'count': int(histogram[i])}
+                for i in range(len(edges) - 1)
+            ],
+        }
+
+
+snapshot = CatalogSnapshot(app.config['CATALOG_PRICE_BUCKETS'])
+catalog_changes.feed.listen(snapshot.apply_changes)
+
+
+def get_snapshot():
+    """The worker's snapshot, loaded from the database on first use or after the feed skipped changes."""
+    catalog_changes.feed.start()
+    if not snapshot.loaded:
+        # No change reaches the snapshot while it loads, so none falls between the load and the feed
+        with catalog_changes.feed.paused():
+            if not snapshot.loaded:
+                snapshot.load(db.session)
+    return snapshot
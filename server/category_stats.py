@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+# Denormalized per-category counters (product count, in-stock count and price
+# range) so the category menu never has to aggregate over the product table.
+#
+# Product write paths call the functions below inside their own transaction,
+# after the product itself has been added to, changed in or deleted from the
+# session. Counts are adjusted with atomic UPDATEs, and the price range is
+# recomputed from the product table only when prices change. The reconciler
+# rebuilds every row from the product table to repair any drift:
+#
+#     python category_stats.py
+
+# Standard library imports
+import time
+
+# Remote library imports
+from sqlalchemy import case, func, select, update
+
+# Local imports
+from config import db
+from models import Category, CategoryStats, Product
+
+
+def _in_stock(stock):
+    return 1 if stock > 0 else 0
+
+
+def refresh_category(category_id):
+    """Recompute one category's row from the product table. The caller commits."""
+    product_count, in_stock_count, min_price, max_price = db.session.execute(
+        select(
+            func.count(Product.id),
+            func.coalesce(func.sum(case((Product.stock > 0, 1), else_=0)), 0),
+            func.min(Product.price),
+            func.max(Product.price),
+        ).where(Product.category_id == category_id)
+    ).one()
+
+    stats = db.session.get(CategoryStats, category_id)
+    if stats is None:
+        stats = CategoryStats(category_id=category_id)
+        db.session.add(stats)
+    stats.product_count = product_count
+    stats.in_stock_count = in_stock_count
+    stats.min_price = min_price
+    stats.max_price = max_price
+    return stats
+
+
+def refresh_categories(category_ids):
+    """Recompute several categories' rows with one grouped query. The caller commits."""
+    category_ids = set(category_ids)
+    actual = {
+        row.category_id: row for row in db.session.execute(
+            select(
+                Product.category_id,
+                func.count(Product.id).label('product_count'),
+                func.coalesce(func.sum(case((Product.stock > 0, 1), else_=0)), 0).label('in_stock_count'),
+                func.min(Product.price).label('min_price'),
+                func.max(Product.price).label('max_price'),
+            ).where(Product.category_id.in_(category_ids)).group_by(Product.category_id)
+        )
+    }
+    stored = {stats.category_id: stats for stats in
+              CategoryStats.query.filter(CategoryStats.category_id.in_(category_ids))}
+    for category_id in category_ids:
+        row = actual.get(category_id)
+        stats = stored.get(category_id)
+        if stats is None:
+            stats = CategoryStats(category_id=category_id)
+            db.session.add(stats)
+        stats.product_count, stats.in_stock_count, stats.min_price, stats.max_price = (
+            (row.product_count, row.in_stock_count, row.min_price, row.max_price) if row else (0, 0, None, None))
+
+
+def product_added(category_id, price, stock):
+    result = db.session.execute(
+        update(CategoryStats)
+        .where(CategoryStats.category_id == category_id)
+        .values(
+            product_count=CategoryStats.product_count + 1,
+            in_stock_count=CategoryStats.in_stock_count + _in_stock(stock),
+            min_price=case(
+                ((CategoryStats.min_price.is_(None)) | (CategoryStats.min_price > price), price),
+                else_=CategoryStats.min_price),
+            max_price=case(
+                ((CategoryStats.max_price.is_(None)) | (CategoryStats.max_price < price), price),
+                else_=CategoryStats.max_price),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.session.flush()
+        refresh_category(category_id)
+
+
+def stock_changed(category_id, old_stock, stock):
+    delta = _in_stock(stock) - _in_stock(old_stock)
+    if delta:
+        db.session.execute(
+            update(CategoryStats)
+            .where(CategoryStats.category_id == category_id)
+            .values(in_stock_count=CategoryStats.in_stock_count + delta)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def products_changed(changes):
+    """Apply many in-place edits at once; `changes` holds
+    (category_id, old_price, old_stock, price, stock) tuples. The caller commits.
+    """
+    refresh = set()
+    in_stock_deltas = {}
+    for category_id, old_price, old_stock, price, stock in changes:
+        if old_price != price:
+            refresh.add(category_id)
+        else:
+            in_stock_deltas[category_id] = in_stock_deltas.get(category_id, 0) + _in_stock(stock) - _in_stock(old_stock)
+
+    if refresh:
+        db.session.flush()
+        refresh_categories(refresh)
+    for category_id, delta in in_stock_deltas.items():
+        if delta and category_id not in refresh:
+            db.session.execute(
+                update(CategoryStats)
+                .where(CategoryStats.category_id == category_id)
+                .values(in_stock_count=CategoryStats.in_stock_count + delta)
+                .execution_options(synchronize_session=False)
+            )
+
+
+def reconcile():
+    """Rebuild every category's row from the product table. Returns rows fixed."""
+    actual = {
+        row.category_id: row for row in db.session.execute(
+            select(
+                Product.category_id,
+                func.count(Product.id).label('product_count'),
+                func.coalesce(func.sum(case((Product.stock > 0, 1), else_=0)), 0).label('in_stock_count'),
+                func.min(Product.price).label('min_price'),
+                func.max(Product.price).label('max_price'),
+            ).group_by(Product.category_id)
+        )
+    }
+    stored = {stats.category_id: stats for stats in CategoryStats.query.all()}
+
+    fixed = 0
+    for (category_id,) in db.session.execute(select(Category.id)):
+        row = actual.get(category_id)
+        values = (row.product_count, row.in_stock_count, row.min_price, row.max_price) if row else (0, 0, None, None)
+        stats = stored.get(category_id)
+        if stats and (stats.product_count, stats.in_stock_count, stats.min_price, stats.max_price) == values:
+            continue
+        if stats is None:
+            stats = CategoryStats(category_id=category_id)
+            db.session.add(stats)
+        stats.product_count, stats.in_stock_count, stats.min_price, stats.max_price = values
+        fixed += 1
+    db.session.commit()
+    return fixed
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        interval = app.config['CATEGORY_STATS_RECONCILE_INTERVAL_SECONDS']
+        print(f"Reconciling category stats every {interval}s...")
+        while True:
+            fixed = reconcile()
+            if fixed:
+                print(f"Fixed {fixed} category stats rows.")
+            time.sleep(interval)
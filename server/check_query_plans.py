@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# Checks that every filter and sort combination accepted by GET /products is
+# answered through an index. Builds the schema in an in-memory SQLite
+# database, asks the planner for each statement (with bound parameters, as the
+# route runs it) and fails when one would read the product table without an
+# index, or walk a whole index and then sort. The exceptions are listed in
+# ALLOWED_SCANS with the reason.
+#
+#     python check_query_plans.py
+
+# Standard library imports
+import itertools
+import sys
+
+# Remote library imports
+from sqlalchemy import create_engine
+
+# Local imports
+from config import db
+import models  # registers the tables on db.metadata
+from catalog_query import SORTS, parse_product_filters, product_query
+
+SAMPLE_ARGS = {
+    'category_id': '1',
+    'seller_id': '1',
+    'min_price': '10',
+    'max_price': '500',
+    'in_stock': 'true',
+    'q': 'pro',
+}
+
+
+# Filter combinations whose plan may read the product table without an index
+ALLOWED_SCANS = {
+    # Walks the primary key backwards, every row matches, so it stops after LIMIT rows
+    (): 'the unfiltered newest-first listing',
+    # A substring match has no index to use; any other filter still narrows it by one
+    ('q',): 'a name search with no other filter',
+}
+
+
+def query_plan(connection, statement):
+    compiled = statement.compile(connection.engine)
+    parameters = tuple(compiled.params[name] for name in compiled.positiontup)
+    return [row[3] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", parameters)]
+
+
+def plan_problem(plan, filters=(), sort='newest'):
+    """Return why a plan is unacceptable, or None when it is served by an index."""
+    if not any('product' in step for step in plan):
+        return 'product table not in plan'
+    scans_table = any(step == 'SCAN product' for step in plan)
+    scans_index = any(step.startswith('SCAN product USING') for step in plan)
+    sorts = any(step.startswith('USE TEMP B-TREE FOR') and 'ORDER BY' in step for step in plan)
+    if scans_table and not (tuple(filters) in ALLOWED_SCANS and (filters or sort == 'newest')):
+        return 'reads product without an index'
+    if (scans_table or scans_index) and sorts:
+        # A walk in index or rowid order stops after LIMIT rows; one that must be sorted does not
+        return 'full scan of product followed by a sort'
+    return None
+
+
+def check_all():
+    engine = create_engine('sqlite://')
+    db.metadata.create_all(engine)
+    failures = []
+    checked = 0
+    with engine.connect() as connection:
+        for size in range(len(SAMPLE_ARGS) + 1):
+            for names in itertools.combinations(SAMPLE_ARGS, size):
+                for sort in SORTS:
+                    args = {name: SAMPLE_ARGS[name] for name in names}
+                    args['sort'] = sort
+                    filters, errors = parse_product_filters(args)
+                    assert not errors, errors
+                    plan = query_plan(connection, product_query(filters))
+                    checked += 1
+                    problem = plan_problem(plan, names, sort)
+                    if problem:
+                        failures.append((args, problem, plan))
+    return checked, failures
+
+
+if __name__ == '__main__':
+    checked, failures = check_all()
+    for args, problem, plan in failures:
+        print(f"FAIL {args}: {problem}")
+        for step in plan:
+            print(f"    {step}")
+    print(f"Checked {checked} query plans, {len(failures)} failed.")
+    sys.exit(1 if failures else 0)
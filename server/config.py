@@ -1,4 +1,5 @@
 # Standard library imports
+import os
 
 # Remote library imports
 from flask import Flask
@@ -9,6 +10,7 @@ from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import MetaData
 
 # Local imports
+from shard_routing import ShardRoutingSession
 
 # Instantiate app, set attributes
 app = Flask(__name__)
@@ -18,11 +20,95 @@ app.config['SECRET_KEY'] = 'your_secret_key_here'
 app.config['JWT_SECRET_KEY'] = 'your_jwt_secret_key_here'
 app.json.compact = False
 
+# How long an item added to a cart holds its stock, and how often the sweeper
+# releases holds that have run out
+app.config['RESERVATION_TTL_SECONDS'] = 15 * 60
+app.config['RESERVATION_SWEEP_INTERVAL_SECONDS'] = 60
+app.config['RESERVATION_SWEEP_BATCH_SIZE'] = 500
+
+# Responses kept for Idempotency-Key replays (shared by all workers), how long
+# a duplicate waits for the first request, and how often it checks on it
+app.config['IDEMPOTENCY_TTL_SECONDS'] = 24 * 60 * 60
+app.config['IDEMPOTENCY_WAIT_SECONDS'] = 30
+app.config['IDEMPOTENCY_POLL_SECONDS'] = 0.1
+
+# Background job queue: batch size per poll, retry backoff, and how long a
+# job may stay locked before another worker assumes its worker died
+app.config['JOB_BATCH_SIZE'] = 20
+app.config['JOB_POLL_INTERVAL_SECONDS'] = 1
+app.config['JOB_MAX_ATTEMPTS'] = 5
+app.config['JOB_BACKOFF_SECONDS'] = 5
+app.config['JOB_BACKOFF_MAX_SECONDS'] = 10 * 60
+app.config['JOB_LOCK_TIMEOUT_SECONDS'] = 5 * 60
+
+# Uploaded product images: size limit and the thumbnail widths generated
+app.config['IMAGE_MAX_BYTES'] = 10 * 1024 * 1024
+app.config['IMAGE_THUMBNAIL_SIZES'] = (160, 320, 640)
+app.config['IMAGE_POOL_WORKERS'] = 2
+app.config['IMAGE_THUMBNAIL_TIMEOUT_SECONDS'] = 30
+app.config['IMAGE_CACHE_MAX_AGE'] = 365 * 24 * 60 * 60
+
+# How often category_stats.py rebuilds the category counters to fix drift
+app.config['CATEGORY_STATS_RECONCILE_INTERVAL_SECONDS'] = 10 * 60
+
+# Per-worker columnar catalog used for facet counts: the price bucket edges
+app.config['CATALOG_PRICE_BUCKETS'] = (0, 50, 100, 250, 500, 1000, float('inf'))
+
+# "Customers also bought": neighbours kept per product, customers read per
+# chunk and pending pair counts held in memory by a full rebuild
+app.config['RELATED_TOP_K'] = 10
+app.config['RELATED_CHUNK_SIZE'] = 1000
+app.config['RELATED_FLUSH_PAIRS'] = 500000
+
+# Orders older than this move to archived_order, a batch per transaction
+app.config['ORDER_ARCHIVE_AFTER_DAYS'] = 90
+app.config['ORDER_ARCHIVE_BATCH_SIZE'] = 500
+app.config['ORDER_ARCHIVE_INTERVAL_SECONDS'] = 60 * 60
+app.config['ORDER_PAGE_SIZE'] = 50
+app.config['ORDER_PAGE_MAX_SIZE'] = 200
+
+# Coalesced catalog GETs, per worker: how long a response is fresh, how long
+# after that it may still be served while it is rebuilt (0 turns that off),
+# and how many distinct URLs are kept
+app.config['SINGLEFLIGHT_TTL_SECONDS'] = 5
+app.config['SINGLEFLIGHT_STALE_SECONDS'] = 60
+app.config['SINGLEFLIGHT_MAX_ENTRIES'] = 1024
+
+# Most rows a single PATCH /seller/products may change
+app.config['PRODUCT_BULK_UPDATE_MAX_ROWS'] = 10000
+
+# Live carts: 'database', 'memory' or 'kv' (see cart_store.py), how often
+# write-behind stores flush, customers per flush transaction, and how long an
+# idle live cart is kept before it is read back from the cart table
+app.config['CART_STORE'] = 'database'
+app.config['CART_FLUSH_INTERVAL_SECONDS'] = 2
+app.config['CART_FLUSH_BATCH_SIZE'] = 500
+app.config['CART_STORE_TTL_SECONDS'] = 30 * 60
+
+# Stock and price change stream (GET /catalog/changes, see catalog_changes.py):
+# changes kept for resuming, how often each worker reads new ones, how long
+# one stream stays open (under gunicorn's worker timeout) before the client
+# reconnects with Last-Event-ID, and how many streams one worker serves at
+# once (each holds a thread; gunicorn.conf.py sets half its THREADS) before
+# answering 503 with Retry-After
+app.config['CATALOG_CHANGES_LOG_SIZE'] = 10000
+app.config['CATALOG_CHANGES_POLL_SECONDS'] = 0.5
+app.config['CATALOG_STREAM_HEARTBEAT_SECONDS'] = 10
+app.config['CATALOG_STREAM_MAX_SECONDS'] = 25
+app.config['CATALOG_STREAM_RETRY_MS'] = 1000
+app.config['CATALOG_STREAM_MAX_CLIENTS'] = int(os.environ.get('CATALOG_STREAM_MAX_CLIENTS', 4))
+app.config['CATALOG_STREAM_BUSY_RETRY_SECONDS'] = 5
+
+# Customer shards for carts and orders (0 keeps them in app.db; change it
+# only together with `python sharding.py reshard N`, see sharding.py)
+app.config['CUSTOMER_SHARDS'] = int(os.environ.get('CUSTOMER_SHARDS', 0))
+app.config['CUSTOMER_SHARD_URI'] = 'sqlite:///{instance_path}/shards/customer_{index}.db'
+
 # Define metadata, instantiate db
 metadata = MetaData(naming_convention={
     "fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s",
 })
-db = SQLAlchemy(metadata=metadata)
+db = SQLAlchemy(metadata=metadata, session_options={'class_': ShardRoutingSession})
 # migrate = Migrate(app, db)
 # db.init_app(app)
 
@@ -30,4 +116,4 @@ db = SQLAlchemy(metadata=metadata)
 api = Api(app)
 
 # Instantiate CORS
-CORS(app, resources={r"/*": {"origins": "http://127.0.0.1:5173"}})
+CORS(app, resources={r"/*": {"origins": "http://127.0.0.1:5173"}}, expose_headers=['X-Catalog-Change-Id'])
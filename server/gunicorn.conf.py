@@ -0,0 +1,63 @@
+# Production server settings. Start the API with:
+#
+#     gunicorn app:app
+#
+# from this directory; gunicorn picks this file up automatically. Every
+# setting can be overridden with the environment variables read below.
+
+# Standard library imports
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5555')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+
+# Threaded workers. GET /catalog/changes belongs on the stream server
+# (gunicorn_streams.conf.py); a stream that reaches these workers holds its
+# thread for up to CATALOG_STREAM_MAX_SECONDS, so each serves at most half
+# its threads as streams and answers further ones with 503 (read by
+# config.py, so set it here first)
+worker_class = 'gthread'
+threads = int(os.environ.get('THREADS', 8))
+os.environ.setdefault('CATALOG_STREAM_MAX_CLIENTS', str(max(threads // 2, 1)))
+
+# Load the app once in the master so workers share its memory copy-on-write
+preload_app = True
+
+# Recycle each worker after a jittered number of requests, letting in-flight
+# requests finish, so slow leaks never build up and workers don't all restart
+# at the same moment
+max_requests = int(os.environ.get('MAX_REQUESTS', 5000))
+max_requests_jitter = int(os.environ.get('MAX_REQUESTS_JITTER', 500))
+graceful_timeout = 30
+timeout = 30
+keepalive = 5
+
+accesslog = os.environ.get('ACCESS_LOG')  # off unless asked for
+loglevel = os.environ.get('LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    # Runs in the master before the listening socket is bound, so no traffic
+    # reaches a cold server
+    from app import app
+    from warmup import warm_up
+    import catalog_changes
+
+    with app.app_context():
+        statuses = warm_up(app)
+    # Loading the catalog snapshot started the change feed; each worker starts its own
+    catalog_changes.feed.stop()
+    server.log.info("Warmed up: %s", ", ".join(f"{path} {status}" for path, status in statuses.items()))
+
+
+def post_fork(server, worker):
+    # Connections opened by the master during warm-up must not be shared with
+    # the children; drop them from the pool without closing the parent's sockets
+    from app import app
+    from config import db
+    import shard_routing
+
+    with app.app_context():
+        db.engine.dispose(close=False)
+    shard_routing.dispose_engines(close=False)
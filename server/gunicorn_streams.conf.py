@@ -0,0 +1,31 @@
+# Server for GET /catalog/changes alone. Start it next to the API with:
+#
+#     gunicorn -c gunicorn_streams.conf.py app:app
+#
+# from this directory, and route /catalog/changes to it (see README.md).
+# The API's threaded workers give each stream a thread, so they serve only a
+# few; here each stream is a greenlet and one worker holds thousands of idle
+# connections. Every setting can be overridden with the environment
+# variables read below.
+
+# Standard library imports
+import os
+
+bind = os.environ.get('STREAM_BIND', '0.0.0.0:5556')
+workers = int(os.environ.get('STREAM_WORKERS', 1))
+
+worker_class = 'gevent'
+worker_connections = int(os.environ.get('STREAM_WORKER_CONNECTIONS', 2000))
+# Streams this worker serves before answering 503 (read by config.py, so set it here first)
+os.environ.setdefault('CATALOG_STREAM_MAX_CLIENTS', str(max(worker_connections - 100, 1)))
+
+# The gevent worker patches threading after the fork; the app must be
+# imported after that, or the change feed's locks block the whole worker
+preload_app = False
+
+graceful_timeout = 30
+timeout = 30
+keepalive = 5
+
+accesslog = os.environ.get('ACCESS_LOG')  # off unless asked for
+loglevel = os.environ.get('LOG_LEVEL', 'info')
@@ -0,0 +1,151 @@
+# Idempotency-Key support for retried POSTs.
+#
+# A client that times out can resend the same request with the same
+# Idempotency-Key header. The first request claims the key by inserting an
+# idempotency_key row (unique per user and key), runs the view and stores its
+# response in that row; replays get the stored response without running the
+# view again, and duplicates that arrive while the first request is still
+# running wait for it to finish. The table is shared by every gunicorn worker,
+# so a retry that lands on another worker is still recognised.
+#
+# - Rows expire after IDEMPOTENCY_TTL_SECONDS and are pruned by later claims.
+# - A request that fails (an exception or a 5xx) gives its key up, so the next
+#   retry does the work again.
+# - If a worker dies mid-request its claim is taken over by a retry after
+#   IDEMPOTENCY_WAIT_SECONDS, longer than gunicorn lets a request run.
+# - The response is stored just after the view commits; a worker killed in
+#   between leaves a claim that is taken over as above, and that retry runs
+#   the view again.
+
+# Standard library imports
+import hashlib
+import time
+import uuid
+from datetime import datetime, timedelta
+from functools import wraps
+
+# Remote library imports
+from flask import request, jsonify, current_app
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.sqlite import insert
+
+# Local imports
+from config import app, db
+from models import IdempotencyKey
+
+_keys = IdempotencyKey.__table__
+
+
+def _for(user_id, key):
+    return (_keys.c.user_id == user_id) & (_keys.c.key == key)
+
+
+def claim(user_id, key, fingerprint):
+    """Claim a key for this request. Returns the claim's token, or None when
+    another request holds or has finished the key."""
+    now = datetime.now()
+    token = uuid.uuid4().hex
+    expires_at = now + timedelta(seconds=app.config['IDEMPOTENCY_TTL_SECONDS'])
+    # A connection of its own: the claim must be visible to other workers before the view runs
+    with db.engine.begin() as connection:
+        connection.execute(delete(_keys).where(_keys.c.expires_at <= now))
+        inserted = connection.execute(
+            insert(_keys)
+            .values(user_id=user_id, key=key, fingerprint=fingerprint, token=token,
+                    claimed_at=now, expires_at=expires_at)
+            .on_conflict_do_nothing(index_elements=['user_id', 'key'])
+        ).rowcount
+        if inserted:
+            return token
+        # Take over a claim whose worker died before finishing it
+        abandoned_before = now - timedelta(seconds=app.config['IDEMPOTENCY_WAIT_SECONDS'])
+        taken = connection.execute(
+            update(_keys)
+            .where(_for(user_id, key))
+            .where(_keys.c.fingerprint == fingerprint)
+            .where(_keys.c.status_code.is_(None))
+            .where(_keys.c.claimed_at <= abandoned_before)
+            .values(token=token, claimed_at=now, expires_at=expires_at)
+        ).rowcount
+        return token if taken else None
+
+
+def finish(user_id, key, token, response):
+    """Store the claimed request's response, or give the key up when it is None."""
+    with db.engine.begin() as connection:
+        where = _for(user_id, key) & (_keys.c.token == token)
+        if response is None:
+            connection.execute(delete(_keys).where(where))
+        else:
+            body, status_code, mimetype = response
+            connection.execute(update(_keys).where(where)
+                               .values(body=body, status_code=status_code, mimetype=mimetype))
+
+
+def _stored(user_id, key):
+    with db.engine.connect() as connection:
+        return connection.execute(
+            select(_keys.c.fingerprint, _keys.c.status_code, _keys.c.body, _keys.c.mimetype)
+            .where(_for(user_id, key))
+        ).first()
+
+
+def _fingerprint():
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.path.encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def _replay(row):
+    replay = current_app.response_class(row.body, status=row.status_code, mimetype=row.mimetype)
+    replay.headers['Idempotent-Replayed'] = 'true'
+    return replay
+
+
+def _wait_for_original(user_id, key, fingerprint):
+    deadline = time.monotonic() + app.config['IDEMPOTENCY_WAIT_SECONDS']
+    while True:
+        row = _stored(user_id, key)
+        if row is None:
+            return jsonify({'msg': 'Original request failed, please retry'}), 409
+        if row.fingerprint != fingerprint:
+            return jsonify({'msg': 'Idempotency-Key was already used for a different request'}), 422
+        if row.status_code is not None:
+            return _replay(row)
+        if time.monotonic() >= deadline:
+            return jsonify({'msg': 'Original request is still in progress'}), 409
+        time.sleep(app.config['IDEMPOTENCY_POLL_SECONDS'])
+
+
+def idempotent(view):
+    """Honour an Idempotency-Key header on a view. Apply below @jwt_required()."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > IdempotencyKey.key.type.length:
+            return jsonify({'msg': 'Idempotency-Key is too long'}), 400
+
+        user_id = get_jwt_identity()['id']
+        fingerprint = _fingerprint()
+        token = claim(user_id, key, fingerprint)
+        if token is None:
+            return _wait_for_original(user_id, key, fingerprint)
+
+        stored = None
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code < 500:
+                stored = (response.get_data(), response.status_code, response.mimetype)
+            return response
+        finally:
+            if stored is None:
+                # Let go of anything the failed view left open before writing on another connection
+                db.session.rollback()
+            finish(user_id, key, token, stored)
+
+    return wrapper
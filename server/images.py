@@ -0,0 +1,131 @@
+# Product image storage and thumbnails.
+#
+# Uploaded originals are stored on local disk under their SHA-256 digest, so
+# the same file uploaded twice is stored once and a URL never changes meaning.
+# Thumbnails in each of IMAGE_THUMBNAIL_SIZES are written next to them as
+# JPEG and WebP by a process pool, keeping Pillow's CPU work off the request
+# threads. Everything under /images/ is immutable and served with a one-year
+# cache lifetime.
+
+# Standard library imports
+import hashlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+# Remote library imports
+from PIL import Image
+from flask import url_for
+
+# Local imports
+from config import app
+
+FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+VARIANTS = (('jpg', 'JPEG'), ('webp', 'WEBP'))
+
+_pool = None
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+class ThumbnailsUnavailable(RuntimeError):
+    """The thumbnail pool timed out or died; the upload can be retried."""
+
+
+def image_root():
+    return os.path.join(app.instance_path, 'images')
+
+
+def _shard(digest):
+    return os.path.join(digest[:2], digest[2:4])
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _make_variants(root, relative_original, digest, sizes):
+    # Runs in a pool process: build every thumbnail that does not exist yet
+    written = []
+    with Image.open(os.path.join(root, relative_original)) as original:
+        original.load()
+        if original.mode not in ('RGB', 'RGBA'):
+            original = original.convert('RGBA' if 'transparency' in original.info else 'RGB')
+        for size in sizes:
+            for ext, fmt in VARIANTS:
+                relative = os.path.join('thumbs', _shard(digest), f"{digest}_{size}.{ext}")
+                path = os.path.join(root, relative)
+                if os.path.exists(path):
+                    continue
+                thumb = original.copy()
+                thumb.thumbnail((size, size))
+                if fmt == 'JPEG' and thumb.mode != 'RGB':
+                    thumb = thumb.convert('RGB')
+                buffer = io.BytesIO()
+                thumb.save(buffer, fmt, quality=82, optimize=True)
+                _write_atomic(path, buffer.getvalue())
+                written.append(relative)
+    return written
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=app.config['IMAGE_POOL_WORKERS'])
+    return _pool
+
+
+def store_upload(data):
+    """Store an uploaded image and its thumbnails. Returns the content digest."""
+    if len(data) > app.config['IMAGE_MAX_BYTES']:
+        raise InvalidImage('Image is too large')
+    try:
+        with Image.open(io.BytesIO(data)) as probe:
+            probe.verify()
+            fmt = probe.format
+    except Exception:
+        raise InvalidImage('File is not a readable image')
+    if fmt not in FORMATS:
+        raise InvalidImage(f"Unsupported image format {fmt}")
+
+    digest = hashlib.sha256(data).hexdigest()
+    root = image_root()
+    relative_original = os.path.join('originals', _shard(digest), f"{digest}.{FORMATS[fmt]}")
+    if not os.path.exists(os.path.join(root, relative_original)):
+        _write_atomic(os.path.join(root, relative_original), data)
+
+    global _pool
+    try:
+        future = _get_pool().submit(_make_variants, root, relative_original, digest,
+                                    app.config['IMAGE_THUMBNAIL_SIZES'])
+        future.result(timeout=app.config['IMAGE_THUMBNAIL_TIMEOUT_SECONDS'])
+    except TimeoutError:
+        raise ThumbnailsUnavailable('Thumbnails are taking too long, please retry')
+    except BrokenProcessPool:
+        # A pool process died (killed, out of memory); the pool is unusable from now on
+        _pool = None
+        raise ThumbnailsUnavailable('Thumbnail workers restarted, please retry')
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError):
+        # Pillow found a problem verify() let through while decoding the whole image
+        raise InvalidImage('Image could not be processed')
+    return digest
+
+
+def thumbnail_urls(image_hash):
+    """URLs of every thumbnail of an image, keyed by size then format."""
+    if not image_hash:
+        return None
+    return {
+        str(size): {
+            ext: url_for('serve_image', filename=f"thumbs/{image_hash[:2]}/{image_hash[2:4]}/{image_hash}_{size}.{ext}")
+            for ext, _ in VARIANTS
+        }
+        for size in app.config['IMAGE_THUMBNAIL_SIZES']
+    }
@@ -0,0 +1,122 @@
+# Durable background job queue backed by the job table.
+#
+# Request handlers call enqueue() inside their own transaction, so a job is
+# stored if and only if the work that produced it commits. Workers (see
+# worker.py) claim jobs in batches, run the handler registered for each kind
+# and delete the job on success. Failures are retried with exponential
+# backoff; after JOB_MAX_ATTEMPTS the job is moved to the dead_job table.
+# Handlers may run more than once and must be safe to repeat.
+
+# Standard library imports
+import random
+import traceback
+from datetime import datetime, timedelta
+
+# Remote library imports
+from sqlalchemy import select, update
+
+# Local imports
+from config import app, db
+from models import Job, DeadJob
+
+handlers = {}
+
+
+def handler(kind):
+    """Register a function as the handler for jobs of `kind`."""
+    def register(fn):
+        handlers[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(kind, payload, run_at=None):
+    """Add a job to the current session. The caller commits."""
+    now = datetime.now()
+    job = Job(kind=kind, payload=payload, status='queued', attempts=0,
+              run_at=run_at or now, created_at=now)
+    db.session.add(job)
+    return job
+
+
+def requeue_stale(now=None):
+    """Put back jobs whose worker stopped before finishing them."""
+    now = now or datetime.now()
+    cutoff = now - timedelta(seconds=app.config['JOB_LOCK_TIMEOUT_SECONDS'])
+    result = db.session.execute(
+        update(Job)
+        .where(Job.status == 'running', Job.locked_at < cutoff)
+        .values(status='queued', locked_at=None, locked_by=None)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def claim_batch(worker_id, batch_size=None, now=None):
+    """Lock up to `batch_size` due jobs for this worker and return them."""
+    batch_size = batch_size or app.config['JOB_BATCH_SIZE']
+    now = now or datetime.now()
+    ids = db.session.execute(
+        select(Job.id)
+        .where(Job.status == 'queued', Job.run_at <= now)
+        .order_by(Job.run_at, Job.id)
+        .limit(batch_size)
+    ).scalars().all()
+    if not ids:
+        return []
+
+    # The status check makes the claim safe when two workers picked the same ids
+    db.session.execute(
+        update(Job)
+        .where(Job.id.in_(ids), Job.status == 'queued')
+        .values(status='running', locked_at=now, locked_by=worker_id)
+    )
+    db.session.commit()
+    return Job.query.filter(Job.id.in_(ids), Job.locked_by == worker_id, Job.status == 'running') \
+        .order_by(Job.run_at, Job.id).all()
+
+
+def _backoff(attempts):
+    delay = app.config['JOB_BACKOFF_SECONDS'] * 2 ** (attempts - 1)
+    delay = min(delay, app.config['JOB_BACKOFF_MAX_SECONDS'])
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def run_job(job):
+    """Run one claimed job and record the outcome. Returns True on success."""
+    try:
+        fn = handlers.get(job.kind)
+        if fn is None:
+            raise LookupError(f"No handler registered for job kind '{job.kind}'")
+        # Deleted before the handler runs: a handler writing a customer shard must
+        # take its lock after app.db's (see sharding.py). A failure rolls it back
+        db.session.delete(job)
+        db.session.flush()
+        fn(job.payload)
+        db.session.commit()
+        return True
+    except Exception:
+        db.session.rollback()
+        job.attempts += 1
+        job.last_error = traceback.format_exc()
+        now = datetime.now()
+        if job.attempts >= app.config['JOB_MAX_ATTEMPTS']:
+            db.session.add(DeadJob(job_id=job.id, kind=job.kind, payload=job.payload,
+                                   attempts=job.attempts, last_error=job.last_error,
+                                   created_at=job.created_at, failed_at=now))
+            db.session.delete(job)
+        else:
+            job.status = 'queued'
+            job.locked_at = None
+            job.locked_by = None
+            job.run_at = now + _backoff(job.attempts)
+        db.session.commit()
+        return False
+
+
+def run_pending(worker_id, batch_size=None):
+    """Claim and run one batch. Returns the number of jobs processed."""
+    batch = claim_batch(worker_id, batch_size)
+    for job in batch:
+        run_job(job)
+    return len(batch)
@@ -68,6 +68,17 @@ class Category(db.Model, SerializerMixin):
 
 # Product model
 class Product(db.Model, SerializerMixin):
+    # Serve the filters and sort orders of GET /products, see catalog_query.py
+    __table_args__ = (
+        db.Index('ix_product_category_id', 'category_id'),
+        db.Index('ix_product_seller_id', 'seller_id'),
+        db.Index('ix_product_category_price', 'category_id', 'price'),
+        db.Index('ix_product_seller_price', 'seller_id', 'price'),
+        db.Index('ix_product_price', 'price'),
+        # Newest in-stock products; the query must spell out `stock > 0` for SQLite to use it
+        db.Index('ix_product_in_stock_id', 'id', sqlite_where=db.text('stock > 0')),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     seller_id = db.Column(db.Integer, db.ForeignKey('seller.id'), nullable=False)
     name = db.Column(db.String(100), nullable=False)
@@ -75,7 +86,11 @@ class Product(db.Model, SerializerMixin):
     price = db.Column(db.Float, nullable=False)
     stock = db.Column(db.Integer, nullable=False)
     image_url = db.Column(db.String(200))
+    image_hash = db.Column(db.String(64)) # digest of the uploaded image, see images.py
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
+    version = db.Column(db.Integer, nullable=False, server_default='1') # bumped by every seller edit, see product_updates.py
+    # ORM updates check and bump the version too, so they can't overwrite a bulk edit
+    __mapper_args__ = {'version_id_col': version}
 
     seller = db.relationship('Seller', backref=db.backref('products', lazy=True))
     # Remove the duplicate backref here
@@ -87,12 +102,20 @@ class Product(db.Model, SerializerMixin):
 
 # Order model
 class Order(db.Model, SerializerMixin):
+    __table_args__ = (
+        db.Index('ix_order_customer_id', 'customer_id'),
+        db.Index('ix_order_customer_product', 'customer_id', 'product_id'),
+        db.Index('ix_order_product_customer', 'product_id', 'customer_id'),
+        db.Index('ix_order_order_date', 'order_date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     total_price = db.Column(db.Float, nullable=False)
     order_date = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(50), nullable=False, default='pending')
 
     customer = db.relationship('Customer', backref=db.backref('orders', lazy=True))
     product = db.relationship('Product', backref=db.backref('orders', lazy=True))
@@ -102,6 +125,11 @@ class Order(db.Model, SerializerMixin):
     
 # Cart model
 class Cart(db.Model, SerializerMixin):
+    # Every cart read is by customer, and adding to the cart looks up the customer's line for a product
+    __table_args__ = (
+        db.Index('ix_cart_customer_product', 'customer_id', 'product_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
@@ -125,4 +153,157 @@ class OrderHistory(db.Model, SerializerMixin):
     product = db.relationship('Product', backref=db.backref('order_history', lazy=True))
 
     def repr(self):
-        return f"<OrderHistory {self.order_id} - {self.product_id} ({self.quantity})>"
\ No newline at end of file
+        return f"<OrderHistory {self.order_id} - {self.product_id} ({self.quantity})>"
+
+# Reservation model: a time-limited hold on stock for an item sitting in a cart
+class Reservation(db.Model, SerializerMixin):
+    __table_args__ = (
+        db.UniqueConstraint('customer_id', 'product_id', name='uq_reservation_customer_product'),
+        db.Index('ix_reservation_product_expires', 'product_id', 'expires_at'),
+        db.Index('ix_reservation_expires_at', 'expires_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def repr(self):
+        return f"<Reservation {self.customer_id} - {self.product_id} ({self.quantity})>"
+
+# Job model: a unit of background work waiting for, or held by, a worker
+class Job(db.Model, SerializerMixin):
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued') # 'queued' or 'running'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_at = db.Column(db.DateTime, nullable=False)
+    locked_at = db.Column(db.DateTime)
+    locked_by = db.Column(db.String(100))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    def repr(self):
+        return f"<Job {self.id} {self.kind} ({self.status})>"
+
+# DeadJob model: a job that kept failing after every retry
+class DeadJob(db.Model, SerializerMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False)
+    failed_at = db.Column(db.DateTime, nullable=False)
+
+    def repr(self):
+        return f"<DeadJob {self.job_id} {self.kind}>"
+
+# CategoryStats model: per-category counters kept up to date by product writes
+class CategoryStats(db.Model, SerializerMixin):
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), primary_key=True)
+    product_count = db.Column(db.Integer, nullable=False, default=0)
+    in_stock_count = db.Column(db.Integer, nullable=False, default=0)
+    min_price = db.Column(db.Float)
+    max_price = db.Column(db.Float)
+
+    category = db.relationship('Category', backref=db.backref('stats', uselist=False))
+
+    def repr(self):
+        return f"<CategoryStats {self.category_id} ({self.product_count})>"
+
+
+# ProductPair model: how many customers bought both products, stored in both directions
+class ProductPair(db.Model, SerializerMixin):
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    other_product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+
+    def repr(self):
+        return f"<ProductPair {self.product_id} - {self.other_product_id} ({self.count})>"
+
+# RelatedProduct model: the top products bought together with a product, by rank
+class RelatedProduct(db.Model, SerializerMixin):
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    related_product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    score = db.Column(db.Integer, nullable=False)
+
+    related_product = db.relationship('Product', foreign_keys=[related_product_id])
+
+    def repr(self):
+        return f"<RelatedProduct {self.product_id} #{self.rank} {self.related_product_id}>"
+
+
+# CountedPurchase model: a product a customer bought whose pairs are already in product_pair, see recommendations.py
+class CountedPurchase(db.Model, SerializerMixin):
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+
+    def repr(self):
+        return f"<CountedPurchase {self.customer_id} - {self.product_id}>"
+
+
+# ArchivedOrder model: an order moved out of the order table once it is old, see order_archive.py
+class ArchivedOrder(db.Model, SerializerMixin):
+    __table_args__ = (
+        db.Index('ix_archived_order_customer_id', 'customer_id'),
+        db.Index('ix_archived_order_product_customer', 'product_id', 'customer_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False) # the original order id
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    total_price = db.Column(db.Float, nullable=False)
+    order_date = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(50), nullable=False)
+
+    def repr(self):
+        return f"<ArchivedOrder {self.id} - {self.quantity} x {self.product_id}>"
+
+
+# CatalogChange model: the bounded log of stock and price changes behind GET /catalog/changes, see catalog_changes.py
+class CatalogChange(db.Model, SerializerMixin):
+    # AUTOINCREMENT: ids are never reused after old rows are pruned, so they can serve as event ids
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, nullable=False)
+    category_id = db.Column(db.Integer, nullable=False)
+    # Lets catalog_snapshot.py add a new product; empty in rows logged before it was added
+    seller_id = db.Column(db.Integer)
+    price = db.Column(db.Float, nullable=False)
+    stock = db.Column(db.Integer, nullable=False)
+
+    def repr(self):
+        return f"<CatalogChange {self.id} - {self.product_id}>"
+
+
+# IdempotencyKey model: a claimed Idempotency-Key and, once its request finished, the response, see idempotency.py
+class IdempotencyKey(db.Model, SerializerMixin):
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_key_user_key'),
+        db.Index('ix_idempotency_key_expires_at', 'expires_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False) # digest of method, path and body
+    token = db.Column(db.String(32), nullable=False) # which claim of the key is running it
+    claimed_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    status_code = db.Column(db.Integer) # set with body and mimetype once the request finished
+    body = db.Column(db.LargeBinary)
+    mimetype = db.Column(db.String(100))
+
+    def repr(self):
+        return f"<IdempotencyKey {self.user_id} {self.key}>"
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+# Hot/cold split of the order table.
+#
+# Orders older than ORDER_ARCHIVE_AFTER_DAYS are moved into archived_order in
+# small batches, each its own transaction, so the order table and its indexes
+# only hold recent orders. Their order_history rows are dropped with them, as
+# the archived row carries the same quantity and price. Run the archiver with:
+#
+#     python order_archive.py
+#
+# With customer shards, each shard is archived in turn (see sharding.py).
+#
+# Order ids grow with order_date, so every archived order of a customer has a
+# lower id than their remaining hot orders. orders_page() relies on that to
+# read the archive only when a page runs past the hot orders.
+
+# Standard library imports
+import time
+from datetime import datetime, timedelta
+
+# Remote library imports
+from sqlalchemy import delete, insert, select
+
+# Local imports
+from config import app, db
+from models import ArchivedOrder, Order, OrderHistory
+import sharding
+
+ARCHIVED_COLUMNS = ('id', 'customer_id', 'product_id', 'quantity', 'total_price', 'order_date', 'status')
+
+
+def archive_batch(cutoff, batch_size):
+    """Move up to `batch_size` orders placed before `cutoff`. Returns how many moved."""
+    ids = db.session.execute(
+        select(Order.id).where(Order.order_date < cutoff).order_by(Order.id).limit(batch_size)
+    ).scalars().all()
+    if not ids:
+        return 0
+
+    db.session.execute(
+        insert(ArchivedOrder).from_select(
+            ARCHIVED_COLUMNS,
+            select(*(getattr(Order, column) for column in ARCHIVED_COLUMNS)).where(Order.id.in_(ids))
+        )
+    )
+    db.session.execute(delete(OrderHistory).where(OrderHistory.order_id.in_(ids)))
+    db.session.execute(delete(Order).where(Order.id.in_(ids)))
+    db.session.commit()
+    return len(ids)
+
+
+def archive_orders(older_than_days=None, batch_size=None, now=None):
+    """Archive every order older than the cutoff. Returns how many moved."""
+    older_than_days = older_than_days or app.config['ORDER_ARCHIVE_AFTER_DAYS']
+    batch_size = batch_size or app.config['ORDER_ARCHIVE_BATCH_SIZE']
+    cutoff = (now or datetime.now()) - timedelta(days=older_than_days)
+
+    archived = 0
+    for index in sharding.shard_indexes():
+        with sharding.using_shard(index):
+            while True:
+                moved = archive_batch(cutoff, batch_size)
+                archived += moved
+                if moved < batch_size:
+                    break
+    return archived
+
+
+def orders_page(customer_id, before=None, limit=50):
+    """A customer's orders, newest first, across the hot and archived tables.
+
+    Returns (orders, next_before) where `next_before` is the cursor for the
+    following page, or None on the last page.
+    """
+    hot = Order.query.filter(Order.customer_id == customer_id)
+    if before is not None:
+        hot = hot.filter(Order.id < before)
+    orders = hot.order_by(Order.id.desc()).limit(limit + 1).all()
+
+    if len(orders) <= limit:
+        cold = ArchivedOrder.query.filter(ArchivedOrder.customer_id == customer_id)
+        cold_before = orders[-1].id if orders else before
+        if cold_before is not None:
+            cold = cold.filter(ArchivedOrder.id < cold_before)
+        orders += cold.order_by(ArchivedOrder.id.desc()).limit(limit + 1 - len(orders)).all()
+
+    if len(orders) > limit:
+        return orders[:limit], orders[limit - 1].id
+    return orders, None
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        interval = app.config['ORDER_ARCHIVE_INTERVAL_SECONDS']
+        print(f"Archiving orders older than {app.config['ORDER_ARCHIVE_AFTER_DAYS']} days every {interval}s...")
+        while True:
+            archived = archive_orders()
+            if archived:
+                print(f"Archived {archived} orders.")
+            time.sleep(interval)
@@ -0,0 +1,140 @@
+# Bulk price and stock edits for a seller's products (PATCH /seller/products).
+#
+# Every product carries a version that each seller edit bumps. An edit names
+# the version it was based on, and its UPDATE only matches while the product
+# is still at that version, so two editors working from the same read get a
+# conflict for the rows they both touched instead of one silently overwriting
+# the other. Checkout stock decrements leave the version alone: an inventory
+# sync sets absolute counts and must not conflict with every sale.
+#
+# The current versions are read up front, then all edits go to the database
+# as one executemany of the same guarded UPDATE in a single transaction.
+
+# Standard library imports
+from numbers import Real
+
+# Remote library imports
+from sqlalchemy import bindparam, func, select
+
+# Local imports
+from config import app, db
+from models import Product
+import catalog_changes
+import category_stats
+
+# Ids per IN (...) when reading the current rows
+SELECT_CHUNK_SIZE = 500
+# Retries when a row changes between reading the versions and writing
+MAX_ATTEMPTS = 3
+
+_product = Product.__table__
+_guarded_update = (
+    _product.update()
+    .where(_product.c.id == bindparam('b_id'))
+    .where(_product.c.seller_id == bindparam('b_seller_id'))
+    .where(_product.c.version == bindparam('b_version'))
+    .values(
+        price=func.coalesce(bindparam('b_price', type_=db.Float), _product.c.price),
+        stock=func.coalesce(bindparam('b_stock', type_=db.Integer), _product.c.stock),
+        version=_product.c.version + 1,
+    )
+)
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_updates(data):
+    """Validate a PATCH body. Returns (updates, errors); errors are keyed by row index."""
+    rows = data.get('products') if isinstance(data, dict) else None
+    if not isinstance(rows, list) or not rows:
+        return [], {'products': 'must be a non-empty list'}
+    max_rows = app.config['PRODUCT_BULK_UPDATE_MAX_ROWS']
+    if len(rows) > max_rows:
+        return [], {'products': f'must hold at most {max_rows} rows'}
+
+    updates, errors, seen = [], {}, set()
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors[index] = 'must be an object'
+            continue
+        price, stock = row.get('price'), row.get('stock')
+        if not _is_int(row.get('id')):
+            errors[index] = 'id must be an integer'
+        elif row['id'] in seen:
+            errors[index] = 'id appears more than once'
+        elif not _is_int(row.get('version')):
+            errors[index] = 'version must be an integer'
+        elif price is None and stock is None:
+            errors[index] = 'nothing to change, give price and/or stock'
+        elif price is not None and (not isinstance(price, Real) or isinstance(price, bool) or price < 0):
+            errors[index] = 'price must be a non-negative number'
+        elif stock is not None and (not _is_int(stock) or stock < 0):
+            errors[index] = 'stock must be a non-negative integer'
+        else:
+            seen.add(row['id'])
+            updates.append({'id': row['id'], 'version': row['version'], 'price': price, 'stock': stock})
+    return updates, errors
+
+
+def _current_rows(seller_id, ids):
+    rows = {}
+    for start in range(0, len(ids), SELECT_CHUNK_SIZE):
+        for row in db.session.execute(
+            select(_product.c.id, _product.c.category_id, _product.c.price, _product.c.stock, _product.c.version)
+            .where(_product.c.seller_id == seller_id)
+            .where(_product.c.id.in_(ids[start:start + SELECT_CHUNK_SIZE]))
+        ):
+            rows[row.id] = row
+    return rows
+
+
+def apply_updates(seller_id, updates):
+    """Apply validated edits to a seller's products and commit.
+
+    Returns (applied, conflicts, missing): `applied` holds the new state of
+    each updated product, `conflicts` the current version of each product whose
+    version did not match, and `missing` the ids that aren't this seller's.
+    When other writers keep changing the rows for MAX_ATTEMPTS tries, nothing
+    is applied and every row is returned as a conflict.
+    """
+    ids = [update['id'] for update in updates]
+    for attempt in range(MAX_ATTEMPTS):
+        current = _current_rows(seller_id, ids)
+        missing = [id for id in ids if id not in current]
+        conflicts, params, applied, changes = [], [], [], []
+        for update in updates:
+            row = current.get(update['id'])
+            if row is None:
+                continue
+            if row.version != update['version']:
+                conflicts.append({'id': row.id, 'version': row.version})
+                continue
+            price = row.price if update['price'] is None else update['price']
+            stock = row.stock if update['stock'] is None else update['stock']
+            params.append({'b_id': row.id, 'b_seller_id': seller_id, 'b_version': row.version,
+                           'b_price': update['price'], 'b_stock': update['stock']})
+            applied.append({'id': row.id, 'category_id': row.category_id, 'seller_id': seller_id, 'price': price,
+                            'stock': stock, 'version': row.version + 1})
+            changes.append((row.category_id, row.price, row.stock, price, stock))
+
+        if not params:
+            db.session.rollback()
+            return applied, conflicts, missing
+
+        result = db.session.execute(_guarded_update, params)
+        if result.rowcount == len(params):
+            category_stats.products_changed(changes)
+            catalog_changes.record(applied)
+            db.session.commit()
+            return applied, conflicts, missing
+
+        # Another writer got in between the read and the write; read again
+        db.session.rollback()
+
+    # The client retries from the versions reported here
+    current = _current_rows(seller_id, ids)
+    db.session.rollback()
+    conflicts = [{'id': id, 'version': current[id].version} for id in ids if id in current]
+    return [], conflicts, [id for id in ids if id not in current]
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+# "Customers also bought" recommendations.
+#
+# Two products co-occur once for every customer who bought both. The counts
+# live in product_pair (one row per direction) and the top RELATED_TOP_K
+# neighbours of each product are copied into related_product, so the product
+# page reads them with one primary-key range lookup. counted_purchase holds
+# the (customer, product) purchases already included in the counts.
+#
+# A full rebuild reads distinct (customer, product) rows a chunk of
+# customers at a time, counts pairs in memory and flushes them to staging
+# tables whenever RELATED_FLUSH_PAIRS distinct pairs are pending, so memory
+# stays bounded no matter how many order lines there are. The staging tables
+# are then copied over the live ones in one transaction, so product pages
+# keep their recommendations while it runs:
+#
+#     python recommendations.py
+#
+# After checkout, the update_related_products job calls add_purchases() for
+# the customer: products they bought that are not in counted_purchase yet
+# add one to each pair they form with the customer's other purchases. The
+# job runs during a rebuild too; its changes are overwritten by the swap, so
+# the swap queues the job again for every customer who ordered meanwhile.
+
+# Standard library imports
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import combinations
+
+# Remote library imports
+from sqlalchemy import Column, Integer, MetaData, Table, delete, func, insert, select, text, union
+from sqlalchemy.dialects.sqlite import insert as upsert
+
+# Local imports
+from config import app, db
+from models import ArchivedOrder, CountedPurchase, Order, ProductPair
+import jobs
+import sharding
+
+# Purchases are spread over recent and archived orders
+PURCHASE_TABLES = (Order, ArchivedOrder)
+# Orders placed this long before a rebuild started may commit after it read their customer
+REBUILD_MARGIN = timedelta(minutes=5)
+
+staging_metadata = MetaData()
+pair_staging = Table(
+    'product_pair_staging', staging_metadata,
+    Column('product_id', Integer, primary_key=True),
+    Column('other_product_id', Integer, primary_key=True),
+    Column('count', Integer, nullable=False),
+)
+purchase_staging = Table(
+    'counted_purchase_staging', staging_metadata,
+    Column('customer_id', Integer, primary_key=True),
+    Column('product_id', Integer, primary_key=True),
+)
+
+
+def _add_pair_counts(counts, table=ProductPair.__table__):
+    # Upsert pending counts, adding to what is stored. The caller commits
+    if not counts:
+        return
+    # One statement run with executemany: a multi-row VALUES clause is recompiled for every batch
+    statement = upsert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=['product_id', 'other_product_id'],
+        set_={'count': table.c.count + statement.excluded.count},
+    )
+    db.session.execute(statement, [{'product_id': a, 'other_product_id': b, 'count': n}
+                                   for (a, b), n in counts.items()])
+
+
+def refresh_top_k(product_ids=None):
+    """Rewrite related_product from product_pair, for some products or all of them."""
+    where = ''
+    params = {'top_k': app.config['RELATED_TOP_K']}
+    if product_ids is not None:
+        if not product_ids:
+            return
+        where = 'WHERE product_id IN ({})'.format(', '.join(f':p{i}' for i in range(len(product_ids))))
+        params.update({f'p{i}': product_id for i, product_id in enumerate(product_ids)})
+
+    db.session.execute(text(f"DELETE FROM related_product {where}"), params)
+    db.session.execute(text(f"""
+        INSERT INTO related_product (product_id, rank, related_product_id, score)
+        SELECT product_id, rank, other_product_id, count FROM (
+            SELECT product_id, other_product_id, count,
+                   ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY count DESC, other_product_id) AS rank
+            FROM product_pair {where}
+        ) WHERE rank <= :top_k
+    """), params)
+
+
+def _swap_in_staging(started_at):
+    # One transaction: readers see the old recommendations until it commits
+    db.session.execute(delete(ProductPair))
+    db.session.execute(delete(CountedPurchase))
+    db.session.execute(insert(ProductPair).from_select(
+        ['product_id', 'other_product_id', 'count'], select(pair_staging)))
+    db.session.execute(insert(CountedPurchase).from_select(
+        ['customer_id', 'product_id'], select(purchase_staging)))
+    refresh_top_k()
+
+    # Jobs that ran during the rebuild wrote to the tables just replaced; run them again
+    customer_ids = set()
+    for index in sharding.shard_indexes():
+        with sharding.using_shard(index):
+            customer_ids.update(db.session.execute(
+                select(Order.customer_id).where(Order.order_date >= started_at - REBUILD_MARGIN).distinct()
+            ).scalars())
+    for customer_id in sorted(customer_ids):
+        jobs.enqueue('update_related_products', {'customer_id': customer_id})
+    db.session.commit()
+
+
+def rebuild():
+    """Recount every pair from the order tables. Returns the number of pairs stored."""
+    chunk_size = app.config['RELATED_CHUNK_SIZE']
+    flush_pairs = app.config['RELATED_FLUSH_PAIRS']
+    started_at = datetime.now()
+
+    # Left behind by a rebuild that did not finish
+    staging_metadata.drop_all(db.engine)
+    staging_metadata.create_all(db.engine)
+
+    counts = Counter()
+    # A customer's orders all sit on one shard, so shards can be counted one after another
+    for index in sharding.shard_indexes():
+        with sharding.using_shard(index):
+            last_customer_id = 0
+            while True:
+                # Page by customer so a basket never straddles two chunks
+                customer_ids = db.session.execute(
+                    union(*(
+                        select(table.customer_id).where(table.customer_id > last_customer_id)
+                        for table in PURCHASE_TABLES
+                    )).order_by('customer_id').limit(chunk_size)
+                ).scalars().all()
+                if not customer_ids:
+                    break
+                last_customer_id = customer_ids[-1]
+
+                baskets = {}
+                for customer_id, product_id in db.session.execute(union(*(
+                    select(table.customer_id, table.product_id)
+                    .where(table.customer_id.between(customer_ids[0], last_customer_id))
+                    for table in PURCHASE_TABLES
+                ))):
+                    baskets.setdefault(customer_id, []).append(product_id)
+
+                db.session.execute(insert(purchase_staging), [
+                    {'customer_id': customer_id, 'product_id': product_id}
+                    for customer_id, basket in baskets.items() for product_id in basket
+                ])
+                for basket in baskets.values():
+                    for a, b in combinations(basket, 2):
+                        counts[(a, b)] += 1
+                        counts[(b, a)] += 1
+                    if len(counts) >= flush_pairs:
+                        _add_pair_counts(counts, pair_staging)
+                        counts.clear()
+                db.session.commit()
+    _add_pair_counts(counts, pair_staging)
+    db.session.commit()
+
+    _swap_in_staging(started_at)
+    staging_metadata.drop_all(db.engine)
+    return db.session.execute(select(func.count()).select_from(ProductPair)).scalar()
+
+
+def add_purchases(customer_id):
+    """Add the pairs formed by a customer's purchases that are not counted yet.
+
+    Marking the purchases counted in the same transaction makes this safe to
+    run twice for the same orders. The caller commits.
+    """
+    with sharding.using_shard(sharding.shard_index(customer_id)):
+        purchased = db.session.execute(union(*(
+            select(table.product_id).where(table.customer_id == customer_id) for table in PURCHASE_TABLES
+        ))).scalars().all()
+    if not purchased:
+        return
+
+    # The first write takes SQLite's write lock, so a concurrent run for the
+    # same customer either sees these rows or waits for them
+    new = set(db.session.execute(
+        upsert(CountedPurchase)
+        .values([{'customer_id': customer_id, 'product_id': product_id} for product_id in purchased])
+        .on_conflict_do_nothing()
+        .returning(CountedPurchase.product_id)
+    ).scalars())
+    if not new:
+        return
+    earlier = set(db.session.execute(
+        select(CountedPurchase.product_id).where(CountedPurchase.customer_id == customer_id)
+    ).scalars()) - new
+
+    counts = Counter()
+    for a in new:
+        for b in earlier:
+            counts[(a, b)] += 1
+            counts[(b, a)] += 1
+    for a, b in combinations(new, 2):
+        counts[(a, b)] += 1
+        counts[(b, a)] += 1
+    _add_pair_counts(counts)
+
+    touched = sorted(new | earlier)
+    for start in range(0, len(touched), 1000):
+        refresh_top_k(touched[start:start + 1000])
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        print("Rebuilding related products...")
+        pairs = rebuild()
+        print(f"Stored {pairs} product pairs.")
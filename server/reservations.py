@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+# Stock reservations for cart items.
+#
+# Adding to a cart writes a row to the reservation table instead of touching
+# the product row, so a flash sale spreads its writes over many small rows.
+# Available stock is product.stock minus the holds that have not expired yet.
+# Checkout converts a customer's holds into a stock decrement in one guarded
+# UPDATE per product, and the sweeper below deletes expired holds in batches.
+#
+# Run the sweeper with:  python reservations.py
+
+# Standard library imports
+import time
+from datetime import datetime, timedelta
+
+# Remote library imports
+from sqlalchemy import func, select, update
+
+# Local imports
+from config import app, db
+from models import Product, Reservation
+
+
+def reservation_expiry(now=None):
+    now = now or datetime.now()
+    return now + timedelta(seconds=app.config['RESERVATION_TTL_SECONDS'])
+
+
+def _held_quantity(product_id, now, exclude_customer_id=None):
+    # Sum of active holds on a product, as a scalar subquery
+    query = select(func.coalesce(func.sum(Reservation.quantity), 0)).where(
+        Reservation.product_id == product_id,
+        Reservation.expires_at > now,
+    )
+    if exclude_customer_id is not None:
+        query = query.where(Reservation.customer_id != exclude_customer_id)
+    return query.scalar_subquery()
+
+
+def available_stock(product_id, now=None, exclude_customer_id=None):
+    """Stock of a product that is not held by an active reservation."""
+    now = now or datetime.now()
+    stock = db.session.execute(
+        select(Product.stock - _held_quantity(product_id, now, exclude_customer_id))
+        .where(Product.id == product_id)
+    ).scalar()
+    return max(stock or 0, 0)
+
+
+def reserve(customer_id, product_id, quantity, now=None):
+    """Hold `quantity` units of a product for a customer's cart.
+
+    `quantity` is the total the customer wants held, not an increment. The
+    hold is created or resized and its expiry pushed forward. Returns the
+    reservation, or None when there is not enough unreserved stock. The
+    caller commits.
+    """
+    now = now or datetime.now()
+    if available_stock(product_id, now, exclude_customer_id=customer_id) < quantity:
+        return None
+
+    reservation = Reservation.query.filter_by(customer_id=customer_id, product_id=product_id).first()
+    if reservation:
+        reservation.quantity = quantity
+        reservation.expires_at = reservation_expiry(now)
+    else:
+        reservation = Reservation(customer_id=customer_id, product_id=product_id,
+                                  quantity=quantity, expires_at=reservation_expiry(now))
+        db.session.add(reservation)
+    return reservation
+
+
+def release(customer_id, product_id):
+    """Drop a customer's hold on a product. The caller commits."""
+    Reservation.query.filter_by(customer_id=customer_id, product_id=product_id).delete()
+
+
+def convert(customer_id, items, now=None):
+    """Turn a customer's holds into stock decrements at checkout.
+
+    `items` is a list of (product_id, quantity) pairs. Each product gets one
+    UPDATE that only succeeds while enough stock is left once other
+    customers' active holds are set aside, so an expired hold can still be
+    checked out if nobody else claimed the stock. Returns the product ids
+    that could not be converted; the caller must roll back if any are
+    returned and commit otherwise.
+    """
+    now = now or datetime.now()
+    failed = []
+    for product_id, quantity in items:
+        result = db.session.execute(
+            update(Product)
+            .where(Product.id == product_id)
+            .where(Product.stock - _held_quantity(product_id, now, exclude_customer_id=customer_id) >= quantity)
+            .values(stock=Product.stock - quantity)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            failed.append(product_id)
+
+    if not failed:
+        Reservation.query.filter(
+            Reservation.customer_id == customer_id,
+            Reservation.product_id.in_([product_id for product_id, _ in items])
+        ).delete(synchronize_session=False)
+    return failed
+
+
+def release_expired(batch_size=None, now=None):
+    """Delete expired holds in small batches. Returns how many were removed."""
+    batch_size = batch_size or app.config['RESERVATION_SWEEP_BATCH_SIZE']
+    now = now or datetime.now()
+    released = 0
+    while True:
+        ids = db.session.execute(
+            select(Reservation.id).where(Reservation.expires_at <= now).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        Reservation.query.filter(Reservation.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        released += len(ids)
+        if len(ids) < batch_size:
+            break
+    return released
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        interval = app.config['RESERVATION_SWEEP_INTERVAL_SECONDS']
+        print(f"Releasing expired reservations every {interval}s...")
+        while True:
+            released = release_expired()
+            if released:
+                print(f"Released {released} expired reservations.")
+            time.sleep(interval)
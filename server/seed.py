@@ -2,6 +2,7 @@
 
 from app import app
 from models import db, User, Customer, Seller, Product, Order, Category
+import category_stats
 import random
 from faker import Faker
 
@@ -186,6 +187,9 @@ if __name__ == '__main__':
 
             db.session.commit()
             print("Products added successfully.")
+
+            category_stats.reconcile()
+            print("Category stats built successfully.")
         except Exception as e:
             print(f"Error adding products: {e}")
             db.session.rollback()
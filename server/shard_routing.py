@@ -0,0 +1,93 @@
+# Session routing for customer shards, see sharding.py.
+#
+# Kept apart from sharding.py because config.py needs the session class
+# before the models exist.
+
+# Standard library imports
+import os
+import threading
+
+# Remote library imports
+import sqlalchemy as sa
+from flask import current_app, g
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql.util import find_tables
+
+# Tables partitioned by customer; everything else stays on the main database
+SHARDED_TABLES = frozenset({'cart', 'order', 'order_history', 'archived_order'})
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def shard_count():
+    return current_app.config['CUSTOMER_SHARDS']
+
+
+def shard_index(customer_id, count=None):
+    """The shard holding a customer's rows, or None when sharding is off."""
+    count = shard_count() if count is None else count
+    return customer_id % count if count else None
+
+
+def shard_uri(index):
+    return current_app.config['CUSTOMER_SHARD_URI'].format(
+        instance_path=current_app.instance_path, index=index)
+
+
+def shard_engine(index):
+    uri = shard_uri(index)
+    engine = _engines.get(uri)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(uri)
+            if engine is None:
+                if uri.startswith('sqlite:///'):
+                    os.makedirs(os.path.dirname(uri[len('sqlite:///'):]) or '.', exist_ok=True)
+                engine = _engines[uri] = sa.create_engine(uri)
+    return engine
+
+
+def dispose_engines(close=True):
+    for engine in _engines.values():
+        engine.dispose(close=close)
+
+
+def current_shard():
+    return g.get('customer_shard')
+
+
+def set_current_shard(index):
+    g.customer_shard = index
+
+
+def _is_sharded(mapper, clause):
+    if mapper is not None:
+        table = getattr(sa.inspect(mapper), 'local_table', None)
+        return getattr(table, 'name', None) in SHARDED_TABLES
+    if clause is not None:
+        return any(getattr(table, 'name', None) in SHARDED_TABLES
+                   for table in find_tables(clause, include_crud=True))
+    return False
+
+
+class ShardRoutingSession(Session):
+    """Sends statements on the sharded tables to the current customer's shard."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and shard_count() and _is_sharded(mapper, clause):
+            index = current_shard()
+            if index is None:
+                raise RuntimeError(
+                    "Customer data queried outside a shard; call sharding.route_customer() "
+                    "or use sharding.using_shard() first")
+            return shard_engine(index)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(ShardRoutingSession, 'do_orm_execute')
+def _pass_statement(orm_execute_state):
+    # A union over several models reaches get_bind with neither a mapper nor a
+    # clause; hand it the statement so its tables can be checked
+    orm_execute_state.bind_arguments.setdefault('clause', orm_execute_state.statement)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+# Customer shards: carts and orders partitioned by customer_id.
+#
+# With CUSTOMER_SHARDS = N > 0, the cart, order, order_history and
+# archived_order tables live in N SQLite files, customer_id % N picking the
+# file. The catalog, users, stock holds, jobs and everything else stay in
+# app.db. With 0 (the default) nothing changes.
+#
+# Shards keep each customer's carts and orders in smaller files and indexes,
+# and let archiving and other per-customer sweeps run a shard at a time. They
+# do not raise write throughput: adding to the cart writes a stock hold and
+# checkout takes stock, queues jobs and logs catalog changes, all in app.db,
+# so cart and checkout writes still queue for app.db's one writer lock and
+# then take the shard's as well. bench_sharding.py drives POST /cart and
+# POST /orders through the routes; with 4 worker processes on one CPU it ran
+# 44 checkouts/s unsharded, 34 with 2 shards and 42 with 4.
+#
+# A transaction that writes both app.db and a shard writes app.db first.
+# SQLite holds a file's write lock from the first write to the commit, so
+# two transactions taking the two locks in opposite orders wait on each other
+# until the busy timeout and one of them fails with "database is locked".
+#
+# Routing: a request calls route_customer() once it knows the customer, and
+# from then on the session sends statements on the sharded tables to that
+# customer's file (see shard_routing.py). Work over many customers runs once
+# per shard under using_shard(), or in parallel with scatter().
+#
+# A checkout commits to its shard and to app.db. SQLite has no two-phase
+# commit, so the two commits are not atomic with each other; only a failure
+# between them (a full disk, a killed process) can leave them out of step.
+#
+# Ids of sharded rows come from a sequence in each shard, spaced
+# MAX_SHARDS apart and offset by the shard index, so they stay unique when
+# customers move and keep growing over time for every customer.
+#
+# Move rows to a new shard count with the app stopped, then start it with the
+# new CUSTOMER_SHARDS:
+#
+#     python sharding.py reshard 8
+#
+# Alembic only migrates app.db. After `flask db upgrade`, bring the shard
+# files up to the models too (reshard does this for its target shards):
+#
+#     python sharding.py migrate
+#
+# migrate creates missing tables, columns and indexes of the sharded models.
+# A change it cannot make by adding (a dropped or retyped column) is listed
+# and needs a step of its own.
+
+# Standard library imports
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Remote library imports
+from alembic.autogenerate import produce_migrations
+from alembic.migration import MigrationContext
+from alembic.operations import Operations, ops
+from sqlalchemy import Column, Integer, MetaData, String, Table, delete, event, func, select, update
+from sqlalchemy.dialects.sqlite import insert
+
+# Local imports
+from config import app, db
+from models import ArchivedOrder, Cart, Order, OrderHistory
+from shard_routing import current_shard, set_current_shard, shard_count, shard_engine, shard_index
+
+# Id spacing; shard indexes must stay below this
+MAX_SHARDS = 64
+# Rows per transaction when resharding
+MOVE_BATCH_SIZE = 1000
+
+SHARDED_MODELS = (OrderHistory, Order, ArchivedOrder, Cart)
+
+shard_metadata = MetaData()
+id_sequence = Table(
+    'shard_id_sequence', shard_metadata,
+    Column('name', String(50), primary_key=True),
+    Column('next_value', Integer, nullable=False),
+)
+
+
+def route_customer(customer_id):
+    """Send this app context's customer data statements to the customer's shard."""
+    set_current_shard(shard_index(customer_id))
+
+
+@contextmanager
+def using_shard(index):
+    previous = current_shard()
+    set_current_shard(index)
+    try:
+        yield
+    finally:
+        set_current_shard(previous)
+
+
+def shard_indexes():
+    """Every shard, or [None] for app.db when sharding is off."""
+    return list(range(shard_count())) or [None]
+
+
+def group_by_shard(customer_ids):
+    groups = {}
+    for customer_id in customer_ids:
+        groups.setdefault(shard_index(customer_id), []).append(customer_id)
+    return groups
+
+
+def scatter(fn):
+    """Call fn() once per shard, in parallel, and return the results in shard order."""
+    flask_app = app
+
+    def run(index):
+        with flask_app.app_context(), using_shard(index):
+            return fn()
+
+    indexes = shard_indexes()
+    if len(indexes) == 1:
+        return [run(indexes[0])]
+    with ThreadPoolExecutor(max_workers=len(indexes)) as pool:
+        return list(pool.map(run, indexes))
+
+
+def _next_id(connection, name, index):
+    value = connection.execute(
+        update(id_sequence)
+        .where(id_sequence.c.name == name)
+        .values(next_value=id_sequence.c.next_value + 1)
+        .returning(id_sequence.c.next_value)
+    ).scalar()
+    if value is None:
+        raise RuntimeError(f"Shard {index} has no id sequence for {name}; run `python sharding.py reshard`")
+    return value * MAX_SHARDS + index
+
+
+@event.listens_for(Cart, 'before_insert')
+@event.listens_for(Order, 'before_insert')
+@event.listens_for(OrderHistory, 'before_insert')
+def _assign_shard_id(mapper, connection, target):
+    index = current_shard()
+    if target.id is None and index is not None:
+        target.id = _next_id(connection, mapper.local_table.name, index)
+
+
+def _engine(index):
+    return db.engine if index is None else shard_engine(index)
+
+
+def create_schema(index):
+    engine = shard_engine(index)
+    db.metadata.create_all(engine, tables=[model.__table__ for model in SHARDED_MODELS])
+    shard_metadata.create_all(engine)
+
+
+def _additions(operations):
+    # Flatten autogenerate's per-table groups into single operations
+    for operation in operations:
+        if isinstance(operation, ops.ModifyTableOps):
+            yield from _additions(operation.ops)
+        else:
+            yield operation
+
+
+def _describe(operation):
+    if isinstance(operation, ops.AddColumnOp):
+        return f"column {operation.table_name}.{operation.column.name}"
+    if isinstance(operation, ops.CreateIndexOp):
+        return f"index {operation.index_name} on {operation.table_name}"
+    return type(operation).__name__
+
+
+def migrate(index):
+    """Create a shard's missing tables, columns and indexes.
+
+    Returns (what was added, what differs and was left alone)."""
+    create_schema(index)
+    names = {model.__tablename__ for model in SHARDED_MODELS}
+    added, left = [], []
+    with shard_engine(index).begin() as connection:
+        context = MigrationContext.configure(connection, opts={
+            # Shard files hold the sharded tables only; the rest of the models live in app.db
+            'include_object': lambda object, name, type_, reflected, compare_to:
+                type_ != 'table' or name in names,
+        })
+        operations = Operations(context)
+        for operation in _additions(produce_migrations(context, db.metadata).upgrade_ops.ops):
+            if isinstance(operation, (ops.AddColumnOp, ops.CreateIndexOp)):
+                operations.invoke(operation)
+                added.append(_describe(operation))
+            else:
+                left.append(_describe(operation))
+    return added, left
+
+
+def _rows_to_move(source, table, after_id):
+    # A batch of rows with the customer each belongs to
+    if table is OrderHistory.__table__:
+        orders = Order.__table__
+        query = select(table, orders.c.customer_id.label('_customer_id')) \
+            .join(orders, orders.c.id == table.c.order_id)
+    else:
+        query = select(table, table.c.customer_id.label('_customer_id'))
+    query = query.where(table.c.id > after_id).order_by(table.c.id).limit(MOVE_BATCH_SIZE)
+    with _engine(source).connect() as connection:
+        return [dict(row._mapping) for row in connection.execute(query)]
+
+
+def reshard(new_count):
+    """Move every sharded row from the current layout to `new_count` shards."""
+    if not 0 <= new_count <= MAX_SHARDS:
+        raise ValueError(f"The shard count must be between 0 and {MAX_SHARDS}")
+    sources = shard_indexes()
+    targets = list(range(new_count)) or [None]
+    for index in targets:
+        if index is not None:
+            migrate(index)
+
+    moved = {}
+    high_water = 0
+    for source in sources:
+        for model in SHARDED_MODELS:
+            table = model.__table__
+            after_id = 0
+            while rows := _rows_to_move(source, table, after_id):
+                after_id = rows[-1]['id']
+                groups = {}
+                for row in rows:
+                    high_water = max(high_water, row['id'])
+                    target = shard_index(row.pop('_customer_id'), new_count)
+                    if target != source:
+                        groups.setdefault(target, []).append(row)
+                for target, group in groups.items():
+                    # Copy first, then delete: a crash in between leaves copies
+                    # that a rerun skips, never lost rows
+                    with _engine(target).begin() as connection:
+                        connection.execute(insert(table).on_conflict_do_nothing(), group)
+                    with _engine(source).begin() as connection:
+                        connection.execute(delete(table).where(table.c.id.in_([row['id'] for row in group])))
+                    moved[table.name] = moved.get(table.name, 0) + len(group)
+
+    # New ids must be above every id that exists anywhere, moved or not
+    for index in targets:
+        if index is None:
+            continue
+        with shard_engine(index).begin() as connection:
+            for model in SHARDED_MODELS:
+                high_water = max(high_water, connection.execute(
+                    select(func.coalesce(func.max(model.__table__.c.id), 0))).scalar())
+    for index in targets:
+        if index is None:
+            continue
+        with shard_engine(index).begin() as connection:
+            for model in SHARDED_MODELS:
+                statement = insert(id_sequence).values(name=model.__tablename__, next_value=high_water // MAX_SHARDS + 1)
+                connection.execute(statement.on_conflict_do_update(
+                    index_elements=['name'],
+                    set_={'next_value': func.max(id_sequence.c.next_value, statement.excluded.next_value)},
+                ))
+    return moved
+
+
+if __name__ == '__main__':
+    from app import app
+
+    usage = "usage: python sharding.py reshard <shard count> | python sharding.py migrate"
+    if sys.argv[1:] == ['migrate']:
+        with app.app_context():
+            if not shard_count():
+                sys.exit("CUSTOMER_SHARDS is 0; flask db upgrade migrates app.db.")
+            for index in range(shard_count()):
+                added, left = migrate(index)
+                print(f"Shard {index}: " + (", ".join(f"added {change}" for change in added) or "up to date"))
+                for change in left:
+                    print(f"    not applied: {change}")
+        sys.exit(0)
+    if len(sys.argv) != 3 or sys.argv[1] != 'reshard' or not sys.argv[2].isdigit():
+        sys.exit(usage)
+    new_count = int(sys.argv[2])
+    with app.app_context():
+        print(f"Resharding customer data from {shard_count()} to {new_count} shards...")
+        for table, count in reshard(new_count).items():
+            print(f"Moved {count} {table} rows.")
+    print(f"Done. Start the app with CUSTOMER_SHARDS={new_count}.")
@@ -0,0 +1,156 @@
+# Single-flight coalescing and short-lived caching for expensive GETs.
+#
+# Within a worker, concurrent requests for the same path and query string
+# share one computation: the first request runs the view and everyone who
+# arrives meanwhile waits for its serialized response instead of running the
+# same queries again. Successful responses are then served from memory for
+# SINGLEFLIGHT_TTL_SECONDS. For SINGLEFLIGHT_STALE_SECONDS after that an
+# expired response is still served while one background thread rebuilds it,
+# so a request never waits on a rebuild that has already been done once.
+# Product writes call invalidate(), which turns every entry stale; writes in
+# other workers do not, so a view whose clients must know how old a response
+# is says so in a header (see X-Catalog-Change-Id in app.py). Headers the
+# view sets are kept with the cached response.
+#
+# Counters for each outcome are served by GET /metrics/singleflight.
+
+# Standard library imports
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import wraps
+
+# Remote library imports
+from flask import request, current_app, has_request_context
+
+# Local imports
+from config import app
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+
+
+class SingleFlight:
+    def __init__(self, ttl_seconds, stale_seconds, max_entries):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self.metrics = Counter()
+        self._entries = OrderedDict()  # key -> (response, fresh_until)
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _store(self, key, response):
+        self._entries[key] = (response, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _run(self, key, call, compute):
+        try:
+            call.response = compute()
+        finally:
+            with self._lock:
+                if call.response is not None and call.response[1] == 200:
+                    self._store(key, call.response)
+                del self._calls[key]
+            call.done.set()
+
+    def _revalidate(self, key, call, compute):
+        try:
+            self._run(key, call, compute)
+        except Exception:
+            with self._lock:
+                self.metrics['errors'] += 1
+            app.logger.exception("Revalidating %s failed", key)
+
+    def get(self, key, compute):
+        """Return (response, outcome) for `key`, computing it at most once at a time."""
+        now = time.monotonic()
+        with self._lock:
+            self.metrics['requests'] += 1
+            entry = self._entries.get(key)
+            call = self._calls.get(key)
+
+            if entry is not None:
+                response, fresh_until = entry
+                if now < fresh_until:
+                    self.metrics['hits'] += 1
+                    return response, 'hit'
+                if now < fresh_until + self.stale_seconds:
+                    self.metrics['stale'] += 1
+                    if call is None:
+                        self.metrics['revalidations'] += 1
+                        call = self._calls[key] = _Call()
+                        threading.Thread(target=self._revalidate, args=(key, call, compute), daemon=True).start()
+                    return response, 'stale'
+
+            if call is not None:
+                self.metrics['coalesced'] += 1
+                leader = False
+            else:
+                self.metrics['computed'] += 1
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if leader:
+            self._run(key, call, compute)
+            return call.response, 'miss'
+
+        call.done.wait()
+        if call.response is None:
+            # The leader failed; compute for ourselves rather than failing every waiter
+            return compute(), 'miss'
+        return call.response, 'coalesced'
+
+    def invalidate(self):
+        """Mark every cached response as expired; they may still be served stale."""
+        with self._lock:
+            now = time.monotonic()
+            for key, (response, fresh_until) in self._entries.items():
+                self._entries[key] = (response, min(fresh_until, now))
+            self.metrics['invalidations'] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.metrics, cached=len(self._entries), in_flight=len(self._calls))
+
+
+flight = SingleFlight(
+    app.config['SINGLEFLIGHT_TTL_SECONDS'],
+    app.config['SINGLEFLIGHT_STALE_SECONDS'],
+    app.config['SINGLEFLIGHT_MAX_ENTRIES'],
+)
+
+
+def invalidate():
+    flight.invalidate()
+
+
+def coalesced(view):
+    """Share one computation of a GET view between identical concurrent requests."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.full_path
+        flask_app = current_app._get_current_object()
+
+        def compute():
+            if has_request_context():
+                response = flask_app.make_response(view(*args, **kwargs))
+            else:
+                # Revalidating in a background thread, outside any request
+                with flask_app.test_request_context(key):
+                    response = flask_app.make_response(view(*args, **kwargs))
+            headers = [(name, value) for name, value in response.headers
+                       if name not in ('Content-Type', 'Content-Length')]
+            return response.get_data(), response.status_code, response.mimetype, headers
+
+        (body, status, mimetype, headers), outcome = flight.get(key, compute)
+        response = current_app.response_class(body, status=status, mimetype=mimetype, headers=headers)
+        response.headers['X-Cache'] = outcome
+        return response
+
+    return wrapper
@@ -0,0 +1,39 @@
+# Handlers for background jobs. Each one receives the job's JSON payload and
+# may be retried, so it must tolerate running twice for the same payload.
+
+# Local imports
+from config import db
+from jobs import handler
+from models import Order, OrderHistory
+import recommendations
+import sharding
+
+
+@handler('record_order_history')
+def record_order_history(payload):
+    # Orders live on their customer's shard; payloads from before sharding have no customer
+    customer_id = payload.get('customer_id')
+    with sharding.using_shard(sharding.shard_index(customer_id) if customer_id is not None else None):
+        orders = Order.query.filter(Order.id.in_(payload['order_ids'])).all()
+        recorded = {
+            order_id for (order_id,) in
+            db.session.query(OrderHistory.order_id).filter(OrderHistory.order_id.in_(payload['order_ids']))
+        }
+        for order in orders:
+            if order.id in recorded:
+                continue
+            db.session.add(OrderHistory(
+                order_id=order.id,
+                product_id=order.product_id,
+                quantity=order.quantity,
+                total_price=order.total_price
+            ))
+        # Flush while the shard is still selected
+        db.session.flush()
+
+
+@handler('update_related_products')
+def update_related_products(payload):
+    # Older payloads list products only; their purchases are counted with the customer's next order
+    if payload.get('customer_id') is not None:
+        recommendations.add_purchases(payload['customer_id'])
@@ -0,0 +1,187 @@
+# Fixtures for the performance harness: the app bound to a throwaway database
+# seeded at realistic scale, a token per role, and a recorder for the SQL
+# each request runs. Run from server/:
+#
+#     python -m pytest
+
+# Standard library imports
+import random
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# Remote library imports
+import pytest
+from sqlalchemy import event, func, insert, select, text
+
+# Local imports
+from config import app as flask_app, db
+
+# The app must be configured before app.py binds the database
+INSTANCE_PATH = tempfile.mkdtemp(prefix='perf-harness-')
+flask_app.instance_path = INSTANCE_PATH
+flask_app.config.update(
+    TESTING=True,
+    SQLALCHEMY_DATABASE_URI=f"sqlite:///{INSTANCE_PATH}/app.db",
+    # Measure the routes themselves, not the coalescing cache in front of them
+    SINGLEFLIGHT_TTL_SECONDS=0,
+    SINGLEFLIGHT_STALE_SECONDS=0,
+    # Close change streams quickly so the client can read the whole response
+    CATALOG_STREAM_MAX_SECONDS=0.2,
+)
+
+from app import app  # noqa: E402
+from flask_jwt_extended import create_access_token  # noqa: E402
+from models import (  # noqa: E402
+    ArchivedOrder, Cart, Category, Customer, Order, OrderHistory, Product, Seller, User,
+)
+import category_stats  # noqa: E402
+import recommendations  # noqa: E402
+
+SCALE = {
+    'categories': 25,
+    'sellers': 100,
+    'customers': 2000,
+    'products': 10000,
+    'orders': 40000,
+    'archived_orders': 10000,
+    'cart_lines': 4000,
+}
+PASSWORD = 'perf-password'
+# A table with at least this many rows must never be read in full
+LARGE_TABLE_ROWS = 1000
+
+
+def _insert(model, rows):
+    for start in range(0, len(rows), 5000):
+        db.session.execute(insert(model.__table__), rows[start:start + 5000])
+
+
+def _seed():
+    rng = random.Random(40)
+    now = datetime.now()
+    dummy_hash = User(username='-', role='-')
+    dummy_hash.set_password(PASSWORD)
+
+    # Users 1..: the admin, then sellers, then customers. Seller ids equal
+    # their user ids, so both conventions in app.py point at the same rows.
+    users = [{'id': 1, 'username': 'admin', 'password': dummy_hash.password, 'role': 'admin'}]
+    seller_ids = list(range(2, 2 + SCALE['sellers']))
+    customer_user_ids = list(range(seller_ids[-1] + 1, seller_ids[-1] + 1 + SCALE['customers']))
+    users += [{'id': id, 'username': f'seller{id}', 'password': dummy_hash.password, 'role': 'seller'}
+              for id in seller_ids]
+    users += [{'id': id, 'username': f'customer{id}', 'password': dummy_hash.password, 'role': 'customer'}
+              for id in customer_user_ids]
+    _insert(User, users)
+    # The last two sellers are still pending, with no products, for the approve and decline routes
+    _insert(Seller, [{'id': id, 'user_id': id, 'business_name': f'Business {id}',
+                      'business_email': f'seller{id}@example.com', 'business_address': f'{id} Market St',
+                      'status': 'pending' if id in seller_ids[-2:] else 'approved'} for id in seller_ids])
+    _insert(Customer, [{'id': index + 1, 'user_id': user_id, 'name': f'Customer {user_id}',
+                        'email': f'customer{user_id}@example.com', 'address': f'{user_id} Main St',
+                        'phone_no': 700000000 + user_id} for index, user_id in enumerate(customer_user_ids)])
+    _insert(Category, [{'id': id, 'name': f'Category {id}'} for id in range(1, SCALE['categories'] + 1)])
+    approved = seller_ids[:-2]
+    _insert(Product, [{'id': id, 'seller_id': approved[id % len(approved)], 'name': f'Product {id}',
+                       'description': f'Description of product {id}', 'price': round(rng.lognormvariate(4, 1), 2),
+                       'stock': rng.choice([0, 5, 50, 500]), 'image_url': f'https://img.example.com/{id}.jpg',
+                       'category_id': 1 + id % SCALE['categories']}
+                      for id in range(1, SCALE['products'] + 1)])
+
+    def order_row(customer_id, order_date):
+        product_id = rng.randint(1, SCALE['products'])
+        quantity = rng.randint(1, 3)
+        return {'customer_id': customer_id, 'product_id': product_id, 'quantity': quantity,
+                'total_price': round(quantity * 20.0, 2), 'order_date': order_date, 'status': 'pending'}
+
+    archived = [dict(order_row(rng.randint(1, SCALE['customers']), now - timedelta(days=200)), id=id)
+                for id in range(1, SCALE['archived_orders'] + 1)]
+    _insert(ArchivedOrder, archived)
+    orders = [dict(order_row(rng.randint(1, SCALE['customers']), now - timedelta(minutes=SCALE['orders'] - i)),
+                   id=SCALE['archived_orders'] + 1 + i)
+              for i in range(SCALE['orders'])]
+    _insert(Order, orders)
+    _insert(OrderHistory, [{'order_id': row['id'], 'product_id': row['product_id'], 'quantity': row['quantity'],
+                            'total_price': row['total_price']} for row in orders])
+    cart = {(rng.randint(1, SCALE['customers']), rng.randint(1, SCALE['products']))
+            for _ in range(SCALE['cart_lines'])}
+    _insert(Cart, [{'customer_id': customer_id, 'product_id': product_id, 'quantity': 1}
+                   for customer_id, product_id in sorted(cart)])
+    db.session.commit()
+
+    category_stats.reconcile()
+    recommendations.rebuild()
+
+    # Well-stocked products for the cart and checkout routes
+    db.session.execute(text("UPDATE product SET stock = 100000 WHERE id <= 50"))
+    db.session.commit()
+    return {
+        'admin_user_id': 1,
+        'seller_user_id': seller_ids[0],
+        'spare_seller_ids': seller_ids[-2:],
+        'customer_user_id': customer_user_ids[0],
+        'customer_id': 1,
+        'product_id': 1,
+    }
+
+
+@pytest.fixture(scope='session')
+def seeded():
+    with app.app_context():
+        db.create_all()
+        ids = _seed()
+    yield ids
+    shutil.rmtree(INSTANCE_PATH, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def tokens(seeded):
+    with app.app_context():
+        return {
+            'admin': create_access_token(identity={'id': seeded['admin_user_id'], 'role': 'admin'}),
+            'seller': create_access_token(identity={'id': seeded['seller_user_id'], 'role': 'seller'}),
+            'customer': create_access_token(identity={'id': seeded['customer_user_id'], 'role': 'customer'}),
+        }
+
+
+@pytest.fixture(scope='session')
+def large_tables(seeded):
+    with app.app_context():
+        return {
+            table.name for table in db.metadata.sorted_tables
+            if db.session.execute(select(func.count()).select_from(table)).scalar() >= LARGE_TABLE_ROWS
+        }
+
+
+@pytest.fixture(scope='session')
+def client(seeded):
+    return app.test_client()
+
+
+@contextmanager
+def recorded_queries():
+    """Collect (sql, parameters) for every statement this thread runs inside the block."""
+    statements = []
+    # The test client serves the request on this thread; background threads
+    # (the catalog change feed, cart flushers) are not the route's work
+    thread = threading.get_ident()
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == thread:
+            statements.append((statement, parameters))
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def query_plan(sql, parameters):
+    with app.app_context():
+        with db.engine.connect() as connection:
+            return [row[3] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", parameters)]
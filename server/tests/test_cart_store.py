@@ -0,0 +1,251 @@
+# The write-behind cart stores ('memory' and 'kv'): live carts, batched
+# flushes to the cart table, recovery from a failed flush, the flush at exit,
+# and how many write transactions they save over the 'database' store.
+# The route budgets run with the default 'database' store.
+
+# Standard library imports
+import threading
+import time
+from contextlib import contextmanager
+
+# Remote library imports
+import pytest
+from sqlalchemy import event, select
+
+# Local imports
+from config import app, db
+from models import Cart, Product, Reservation
+import cart_store
+from cart_store import CartLine, DIRTY_KEY
+
+# Seeded customers that no route budget case uses
+CUSTOMERS = list(range(1990, 2000))
+# Seeded with stock 100000
+PRODUCTS = list(range(1, 11))
+
+
+def _empty_carts():
+    db.session.query(Cart).filter(Cart.customer_id.in_(CUSTOMERS)).delete()
+    db.session.query(Reservation).filter(Reservation.customer_id.in_(CUSTOMERS)).delete()
+    db.session.commit()
+
+
+def _stored_carts():
+    return {(item.customer_id, item.product_id): item.quantity
+            for item in Cart.query.filter(Cart.customer_id.in_(CUSTOMERS))}
+
+
+def _holds():
+    return {(hold.customer_id, hold.product_id): hold.quantity
+            for hold in Reservation.query.filter(Reservation.customer_id.in_(CUSTOMERS))}
+
+
+def _dirty(store):
+    return {int(cart_store._text(id)) for id in store.kv._sets.get(DIRTY_KEY, set())}
+
+
+@contextmanager
+def write_transactions():
+    """Count the committed transactions that wrote something."""
+    counted = []
+
+    def statement(connection, cursor, sql, parameters, context, executemany):
+        if sql.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')):
+            connection.info['wrote'] = True
+
+    def commit(connection):
+        if connection.info.pop('wrote', False):
+            counted.append(1)
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', statement)
+    event.listen(engine, 'commit', commit)
+    try:
+        yield counted
+    finally:
+        event.remove(engine, 'before_cursor_execute', statement)
+        event.remove(engine, 'commit', commit)
+
+
+@pytest.fixture
+def exit_hooks(monkeypatch):
+    hooks = []
+    monkeypatch.setattr(cart_store.atexit, 'register', hooks.append)
+    return hooks
+
+
+@pytest.fixture(params=['memory', 'kv'])
+def store(request, seeded, exit_hooks, monkeypatch):
+    # The tests flush by hand; the flusher thread never wakes
+    monkeypatch.setitem(app.config, 'CART_FLUSH_INTERVAL_SECONDS', 3600)
+    with app.app_context():
+        _empty_carts()
+        yield cart_store.make_store(request.param)
+        db.session.rollback()
+        _empty_carts()
+
+
+def test_changes_stay_in_the_live_cart(store):
+    store.add(CUSTOMERS[0], 1, 2)
+    assert store.add(CUSTOMERS[0], 1, 1) == CartLine(1, 1, 3)
+    store.add(CUSTOMERS[0], 2, 1)
+    assert store.remove(CUSTOMERS[0], 2)
+    assert not store.remove(CUSTOMERS[0], 2)
+
+    assert store.lines(CUSTOMERS[0]) == [CartLine(1, 1, 3)]
+    assert _stored_carts() == {}
+    assert _dirty(store) == {CUSTOMERS[0]}
+
+
+def test_add_refuses_stock_that_is_not_there(store):
+    product = db.session.execute(select(Product).where(Product.stock == 5)).scalars().first()
+    assert store.add(CUSTOMERS[0], product.id, 6) is None
+    assert store.add(CUSTOMERS[0], product.id, 5) == CartLine(product.id, product.id, 5)
+
+
+def test_flush_writes_carts_and_holds(store):
+    store.add(CUSTOMERS[0], 1, 2)
+    store.add(CUSTOMERS[0], 2, 1)
+    store.add(CUSTOMERS[1], 3, 4)
+    store.flush()
+    assert _stored_carts() == {(CUSTOMERS[0], 1): 2, (CUSTOMERS[0], 2): 1, (CUSTOMERS[1], 3): 4}
+    assert _holds() == _stored_carts()
+    assert _dirty(store) == set()
+
+    store.remove(CUSTOMERS[0], 2)
+    store.add(CUSTOMERS[1], 3, 1)
+    store.flush()
+    assert _stored_carts() == {(CUSTOMERS[0], 1): 2, (CUSTOMERS[1], 3): 5}
+    assert _holds() == _stored_carts()
+
+
+def test_flush_commits_one_transaction_per_batch(store, monkeypatch):
+    monkeypatch.setitem(app.config, 'CART_FLUSH_BATCH_SIZE', 3)
+    for customer_id in CUSTOMERS[:7]:
+        store.add(customer_id, 1, 1)
+    with write_transactions() as counted:
+        store.flush()
+    assert len(counted) == 3
+    assert len(_stored_carts()) == 7
+
+
+def test_failed_batch_is_flushed_again(store, monkeypatch):
+    monkeypatch.setitem(app.config, 'CART_FLUSH_BATCH_SIZE', 2)
+    for customer_id in CUSTOMERS[:5]:
+        store.add(customer_id, 1, 1)
+
+    write_shard = store._write_shard
+    calls = []
+
+    def fail_second_batch(customer_ids):
+        calls.append(customer_ids)
+        if len(calls) == 2:
+            raise RuntimeError('database is locked')
+        write_shard(customer_ids)
+
+    monkeypatch.setattr(store, '_write_shard', fail_second_batch)
+    with pytest.raises(RuntimeError):
+        store.flush()
+    assert len(_stored_carts()) == 2
+    assert _dirty(store) == set(CUSTOMERS[:5]) - set(calls[0])
+
+    store.flush()
+    assert _stored_carts() == {(customer_id, 1): 1 for customer_id in CUSTOMERS[:5]}
+    assert _dirty(store) == set()
+
+
+def test_change_during_flush_is_not_lost(store):
+    store.add(CUSTOMERS[0], 1, 1)
+    write_shard = store._write_shard
+
+    def change_then_write(customer_ids):
+        # Arrives after the customer left the dirty set, before the cart is read
+        store._write_shard = write_shard
+        store.add(CUSTOMERS[0], 2, 1)
+        write_shard(customer_ids)
+
+    store._write_shard = change_then_write
+    store.flush()
+    assert _stored_carts() == {(CUSTOMERS[0], 1): 1, (CUSTOMERS[0], 2): 1}
+    assert _dirty(store) == set()
+
+
+def test_checkout_flush_writes_only_that_customer(store):
+    store.add(CUSTOMERS[0], 1, 1)
+    store.add(CUSTOMERS[1], 2, 1)
+    store.flush([CUSTOMERS[0]])
+    assert _stored_carts() == {(CUSTOMERS[0], 1): 1}
+    assert _dirty(store) == {CUSTOMERS[1]}
+
+
+def test_checkout_flush_waits_for_a_flush_in_progress(store):
+    store.add(CUSTOMERS[0], 1, 2)
+    write_shard = store._write_shard
+    writing, finish = threading.Event(), threading.Event()
+
+    def slow_write(customer_ids):
+        # The flusher has taken the customer off the dirty set and not committed yet
+        writing.set()
+        finish.wait(5)
+        write_shard(customer_ids)
+
+    def run(target):
+        with app.app_context():
+            target()
+
+    store._write_shard = slow_write
+    flusher = threading.Thread(target=run, args=(store.flush,))
+    flusher.start()
+    assert writing.wait(5)
+    store._write_shard = write_shard
+
+    seen = []
+    checkout = threading.Thread(target=run, args=(lambda: (store.flush([CUSTOMERS[0]]),
+                                                           seen.append(_stored_carts())),))
+    checkout.start()
+    checkout.join(0.2)
+    assert checkout.is_alive()
+
+    finish.set()
+    flusher.join(5)
+    checkout.join(5)
+    assert seen == [{(CUSTOMERS[0], 1): 2}]
+    assert store._in_flight == set()
+
+
+def test_dirty_carts_are_flushed_at_exit(store, exit_hooks):
+    store.add(CUSTOMERS[0], 1, 2)
+    assert len(exit_hooks) == 1
+    exit_hooks[0]()
+    assert _stored_carts() == {(CUSTOMERS[0], 1): 2}
+
+
+def test_idle_cart_is_read_back_from_the_cart_table(store, monkeypatch):
+    monkeypatch.setitem(app.config, 'CART_STORE_TTL_SECONDS', 0.05)
+    store.add(CUSTOMERS[0], 1, 2)
+    store.flush()
+    time.sleep(0.1)
+    assert store.kv.hgetall(store._key(CUSTOMERS[0])) == {}
+    assert store.lines(CUSTOMERS[0]) == [CartLine(1, 1, 2)]
+
+
+def test_write_behind_cuts_cart_write_transactions(store):
+    changes = [(customer_id, product_id) for customer_id in CUSTOMERS[:5] for product_id in PRODUCTS]
+
+    # As add_to_cart runs them: one commit per change
+    database = cart_store.DatabaseCartStore()
+    with write_transactions() as through:
+        for customer_id, product_id in changes:
+            database.add(customer_id, product_id, 1)
+            db.session.commit()
+    _empty_carts()
+
+    with write_transactions() as behind:
+        for customer_id, product_id in changes:
+            store.add(customer_id, product_id, 1)
+            db.session.commit()
+        store.flush()
+
+    assert len(through) == len(changes)
+    assert len(behind) * 10 <= len(through)
+    assert _stored_carts() == {change: 1 for change in changes}
@@ -0,0 +1,96 @@
+# The change feed behind GET /catalog/changes: what a client opening the
+# stream from an id the worker's feed has not read yet is sent, and the facet
+# snapshot the feed keeps current.
+
+# Remote library imports
+import pytest
+
+# Local imports
+from config import app, db
+from models import Product
+import catalog_changes
+import catalog_snapshot
+
+
+def _log_change(product, **values):
+    catalog_changes.record([{'id': product.id, 'category_id': product.category_id,
+                             'seller_id': product.seller_id, 'price': product.price,
+                             'stock': product.stock, **values}])
+    db.session.commit()
+    return catalog_changes.current_id()
+
+
+@pytest.fixture
+def lagging_feed(seeded, monkeypatch):
+    """A feed that has read the log once and whose thread has not polled since."""
+    with app.app_context():
+        feed = catalog_changes.ChangeFeed(app.config['CATALOG_CHANGES_LOG_SIZE'])
+        feed._poll()
+        monkeypatch.setattr(feed, 'start', lambda: None)
+        monkeypatch.setattr(catalog_changes, 'feed', feed)
+        yield feed
+
+
+def test_newer_id_than_the_feed_is_caught_up_not_reset(lagging_feed):
+    product = db.session.get(Product, 1)
+    # As /categories/products returns it: read from the table, ahead of the feed
+    seen = _log_change(product)
+    newer = _log_change(product)
+    assert lagging_feed.last_id < seen
+
+    events = catalog_changes.stream(seen, None)
+    try:
+        text = ''.join(events)
+    finally:
+        catalog_changes.stream_closed()
+
+    assert 'event: reset' not in text
+    assert text.startswith(f"retry: {app.config['CATALOG_STREAM_RETRY_MS']}\nid: {seen}\n\n")
+    assert f"id: {newer}\ndata: " in text
+    assert f"id: {seen}\ndata: " not in text
+
+
+def test_id_that_was_never_logged_is_reset(lagging_feed):
+    unknown = catalog_changes.current_id() + 100
+
+    events = catalog_changes.stream(unknown, None)
+    try:
+        text = ''.join(events)
+    finally:
+        catalog_changes.stream_closed()
+
+    assert f"event: reset\nid: {lagging_feed.last_id}\n" in text
+
+
+def test_snapshot_follows_the_change_log(lagging_feed):
+    snapshot = catalog_snapshot.CatalogSnapshot(app.config['CATALOG_PRICE_BUCKETS'])
+    lagging_feed.listen(snapshot.apply_changes)
+    with lagging_feed.paused():
+        snapshot.load(db.session)
+    product = db.session.get(Product, 1)
+    filters = {'category_id': product.category_id, 'in_stock': True}
+    before = snapshot.facet_counts(**filters)
+
+    # Logged by another worker: the snapshot only hears of it through the feed
+    sold_out = _log_change(product, stock=0)
+    lagging_feed._poll()
+    after = snapshot.facet_counts(**filters)
+    assert after['version'] == sold_out
+    assert after['total'] == before['total'] - 1
+
+    restocked = _log_change(product)
+    lagging_feed._poll()
+    assert snapshot.facet_counts(**filters) == {**before, 'version': restocked}
+
+
+def test_snapshot_reloads_after_a_gap_in_the_log(lagging_feed):
+    snapshot = catalog_snapshot.CatalogSnapshot(app.config['CATALOG_PRICE_BUCKETS'])
+    with lagging_feed.paused():
+        snapshot.load(db.session)
+    product = db.session.get(Product, 1)
+    _log_change(product)
+    _log_change(product)
+    rows = lagging_feed._read_new()
+
+    snapshot.apply_changes(rows[1:])
+    assert not snapshot.loaded
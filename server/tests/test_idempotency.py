@@ -0,0 +1,120 @@
+# Idempotency-Key on POST /cart: a retry with the same key gets the stored
+# response, a different request under the key is refused, a duplicate of a
+# request still running waits for it, and a claim left by a dead worker is
+# taken over.
+
+# Standard library imports
+import threading
+import time
+import uuid
+
+# Remote library imports
+import pytest
+from flask_jwt_extended import create_access_token
+
+# Local imports
+from config import app, db
+from models import Cart, Customer, IdempotencyKey, Reservation
+import idempotency
+
+# A seeded customer no other test uses
+CUSTOMER_ID = 1980
+# Seeded with stock 100000
+PRODUCT_ID = 1
+
+
+def _empty_cart():
+    db.session.query(Cart).filter_by(customer_id=CUSTOMER_ID).delete()
+    db.session.query(Reservation).filter_by(customer_id=CUSTOMER_ID).delete()
+    db.session.commit()
+
+
+def _cart_quantity():
+    with app.app_context():
+        item = Cart.query.filter_by(customer_id=CUSTOMER_ID, product_id=PRODUCT_ID).first()
+        return item.quantity if item else 0
+
+
+@pytest.fixture
+def customer(seeded, monkeypatch):
+    monkeypatch.setitem(app.config, 'IDEMPOTENCY_POLL_SECONDS', 0.01)
+    with app.app_context():
+        user_id = db.session.get(Customer, CUSTOMER_ID).user_id
+        token = create_access_token(identity={'id': user_id, 'role': 'customer'})
+        _empty_cart()
+    yield user_id, {'Authorization': f'Bearer {token}'}
+    with app.app_context():
+        _empty_cart()
+        db.session.query(IdempotencyKey).filter_by(user_id=user_id).delete()
+        db.session.commit()
+
+
+def _add(client, headers, key, quantity=1):
+    return client.post('/cart', headers={**headers, 'Idempotency-Key': key},
+                       json={'productId': PRODUCT_ID, 'quantity': quantity})
+
+
+def test_retry_gets_the_stored_response(client, customer):
+    _, headers = customer
+    key = uuid.uuid4().hex
+    first = _add(client, headers, key)
+    retry = _add(client, headers, key)
+
+    assert first.status_code == 201
+    assert 'Idempotent-Replayed' not in first.headers
+    assert retry.status_code == 201
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.json == first.json
+    assert _cart_quantity() == 1
+
+
+def test_key_reused_for_a_different_request_is_refused(client, customer):
+    _, headers = customer
+    key = uuid.uuid4().hex
+    assert _add(client, headers, key, quantity=1).status_code == 201
+    response = _add(client, headers, key, quantity=2)
+
+    assert response.status_code == 422
+    assert _cart_quantity() == 1
+
+
+def test_duplicate_waits_for_the_original(client, customer):
+    user_id, headers = customer
+    key = uuid.uuid4().hex
+    body = b'{"msg": "Product added to cart", "cart_item_id": 7}'
+    # The original request is still running on another worker
+    with app.test_request_context('/cart', method='POST', json={'productId': PRODUCT_ID, 'quantity': 1}):
+        token = idempotency.claim(user_id, key, idempotency._fingerprint())
+
+    responses = []
+    duplicate = threading.Thread(target=lambda: responses.append(_add(client, headers, key)))
+    duplicate.start()
+    time.sleep(0.2)
+    assert duplicate.is_alive()
+
+    with app.app_context():
+        idempotency.finish(user_id, key, token, (body, 201, 'application/json'))
+    duplicate.join(5)
+
+    response, = responses
+    assert response.status_code == 201
+    assert response.headers['Idempotent-Replayed'] == 'true'
+    assert response.get_data() == body
+    assert _cart_quantity() == 0
+
+
+def test_abandoned_claim_is_taken_over(client, customer, monkeypatch):
+    user_id, headers = customer
+    key = uuid.uuid4().hex
+    # Claimed by a worker that died before storing a response
+    with app.test_request_context('/cart', method='POST', json={'productId': PRODUCT_ID, 'quantity': 1}):
+        assert idempotency.claim(user_id, key, idempotency._fingerprint())
+
+    monkeypatch.setitem(app.config, 'IDEMPOTENCY_WAIT_SECONDS', 0)
+    response = _add(client, headers, key)
+    replay = _add(client, headers, key)
+
+    assert response.status_code == 201
+    assert 'Idempotent-Replayed' not in response.headers
+    assert replay.headers['Idempotent-Replayed'] == 'true'
+    assert _cart_quantity() == 1
@@ -0,0 +1,65 @@
+# Paging a customer's orders with orders_page() when some of them have been
+# archived: the next_before cursor walks from the hot table into the archive
+# without repeating or skipping an order.
+
+# Standard library imports
+from datetime import datetime, timedelta
+
+# Remote library imports
+import pytest
+from sqlalchemy import delete
+
+# Local imports
+from config import app, db
+from models import ArchivedOrder, Order
+import order_archive
+
+# A seeded customer no other test uses
+CUSTOMER_ID = 1981
+# Older than every seeded order, so archiving up to it moves only this test's orders
+LONG_AGO = datetime(2000, 1, 1)
+
+
+def _delete_orders():
+    db.session.execute(delete(Order).where(Order.customer_id == CUSTOMER_ID))
+    db.session.execute(delete(ArchivedOrder).where(ArchivedOrder.customer_id == CUSTOMER_ID))
+    db.session.commit()
+
+
+@pytest.fixture(scope='module')
+def order_ids(seeded):
+    """Ids of the customer's orders, newest first: four hot, then three archived."""
+    with app.app_context():
+        _delete_orders()
+        dates = [LONG_AGO + timedelta(days=day) for day in range(3)]
+        dates += [datetime.now() - timedelta(minutes=minutes) for minutes in (40, 30, 20, 10)]
+        orders = [Order(customer_id=CUSTOMER_ID, product_id=1, quantity=1, total_price=9.99,
+                        order_date=order_date, status='pending') for order_date in dates]
+        db.session.add_all(orders)
+        db.session.commit()
+        ids = [order.id for order in orders][::-1]
+
+        order_archive.archive_batch(LONG_AGO + timedelta(days=30), 100)
+        assert db.session.query(ArchivedOrder).filter_by(customer_id=CUSTOMER_ID).count() == 3
+        assert db.session.query(Order).filter_by(customer_id=CUSTOMER_ID).count() == 4
+    yield ids
+    with app.app_context():
+        _delete_orders()
+
+
+@pytest.mark.parametrize('limit', range(1, 9))
+def test_pages_cross_into_the_archive_without_gaps(order_ids, limit):
+    seen, pages, before = [], [], None
+    with app.app_context():
+        while True:
+            orders, before = order_archive.orders_page(CUSTOMER_ID, before=before, limit=limit)
+            assert len(orders) <= limit
+            pages.append([type(order) for order in orders])
+            seen += [order.id for order in orders]
+            if before is None:
+                break
+
+    assert seen == order_ids
+    if limit == 3:
+        # The second page holds the last hot order and the first archived ones
+        assert pages[1] == [Order, ArchivedOrder, ArchivedOrder]
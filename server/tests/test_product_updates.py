@@ -0,0 +1,87 @@
+# PATCH /seller/products: rows edited from a stale version come back as
+# conflicts at their current version, the rest are applied, and ids that
+# aren't the seller's are reported as not found.
+
+# Remote library imports
+import pytest
+from sqlalchemy import update
+
+# Local imports
+from config import app, db
+from models import Product
+import product_updates
+
+
+@pytest.fixture
+def seller(client, tokens):
+    return {'Authorization': f"Bearer {tokens['seller']}"}
+
+
+def _products(client, headers, count):
+    return client.get('/seller/products', headers=headers).json[:count]
+
+
+def _edit(product, version=None):
+    return {'id': product['id'], 'version': product['version'] if version is None else version,
+            'stock': product['stock'] + 1}
+
+
+def test_stale_version_is_a_conflict(client, seller):
+    product, = _products(client, seller, 1)
+    response = client.patch('/seller/products', headers=seller,
+                            json={'products': [_edit(product, version=product['version'] - 1)]})
+    assert response.status_code == 409
+    assert response.json == {'updated': [], 'conflicts': [{'id': product['id'], 'version': product['version']}],
+                             'not_found': []}
+
+
+def test_conflicting_rows_do_not_hold_back_the_rest(client, seller):
+    stale, fresh = _products(client, seller, 2)
+    response = client.patch('/seller/products', headers=seller, json={'products': [
+        _edit(stale, version=stale['version'] + 1), _edit(fresh)]})
+    assert response.status_code == 200
+    assert response.json == {'updated': [{'id': fresh['id'], 'version': fresh['version'] + 1}],
+                             'conflicts': [{'id': stale['id'], 'version': stale['version']}], 'not_found': []}
+
+    stale_now, fresh_now = _products(client, seller, 2)
+    assert stale_now['stock'] == stale['stock']
+    assert fresh_now['stock'] == fresh['stock'] + 1
+
+
+def test_products_of_other_sellers_are_not_found(client, seller, seeded):
+    product, = _products(client, seller, 1)
+    other = {'id': seeded['product_id'], 'version': 1, 'stock': 1}
+    assert other['id'] not in {p['id'] for p in client.get('/seller/products', headers=seller).json}
+    response = client.patch('/seller/products', headers=seller, json={'products': [_edit(product), other]})
+    assert response.status_code == 200
+    assert response.json['updated'] == [{'id': product['id'], 'version': product['version'] + 1}]
+    assert response.json['not_found'] == [other['id']]
+
+
+def test_rows_that_keep_changing_come_back_as_conflicts(client, seller, monkeypatch):
+    products = _products(client, seller, product_updates.MAX_ATTEMPTS)
+    current_rows = product_updates._current_rows
+    reads = []
+
+    def read_then_lose_a_race(seller_id, ids):
+        rows = current_rows(seller_id, ids)
+        if len(reads) < len(products):
+            # Another writer edits one more of the rows between this read and the guarded UPDATE
+            with db.engine.begin() as connection:
+                connection.execute(update(Product).where(Product.id == products[len(reads)]['id'])
+                                   .values(version=Product.version + 1))
+        reads.append(ids)
+        return rows
+
+    monkeypatch.setattr(product_updates, '_current_rows', read_then_lose_a_race)
+    response = client.patch('/seller/products', headers=seller,
+                            json={'products': [_edit(product) for product in products]})
+    assert response.status_code == 409
+    assert response.json == {
+        'updated': [],
+        'conflicts': [{'id': product['id'], 'version': product['version'] + 1} for product in products],
+        'not_found': [],
+    }
+    with app.app_context():
+        assert [db.session.get(Product, product['id']).stock for product in products] == \
+            [product['stock'] for product in products]
@@ -0,0 +1,10 @@
+# The GET /products filter and sort combinations, checked by check_query_plans.py.
+
+# Local imports
+import check_query_plans
+
+
+def test_product_search_uses_indexes():
+    checked, failures = check_query_plans.check_all()
+    assert checked
+    assert not failures, "\n".join(f"{args}: {problem} {plan}" for args, problem, plan in failures)
@@ -0,0 +1,195 @@
+# Every route in app.py, called through the test client against the seeded
+# database, must stay within its budget of SQL statements, wall-clock time
+# and response size, and none of its statements may read a large table in
+# full unless the case says why that is expected.
+#
+# Budgets are set a little above what the route needs today, so an N+1 or a
+# lost index fails here first. Slow machines can stretch the time budgets
+# with PERF_TIME_FACTOR=2 (or more).
+
+# Standard library imports
+import io
+import os
+import re
+import time
+import uuid
+from collections import namedtuple
+
+# Remote library imports
+import pytest
+from PIL import Image
+
+# Local imports
+from conftest import query_plan, recorded_queries
+
+TIME_FACTOR = float(os.environ.get('PERF_TIME_FACTOR', 1))
+
+Budget = namedtuple('Budget', ['queries', 'ms', 'kb'])
+
+
+class Case(namedtuple('Case', ['name', 'method', 'path', 'role', 'status', 'budget',
+                               'body', 'setup', 'allow_scans'])):
+    """One route call. `setup(client, headers, seeded)` prepares what the case
+    needs and may return more ids; `path` may use those and the seeded ids, and
+    `body` may be a function of (client, headers, ids). Cases never rely on
+    one another, so any subset runs on its own. `allow_scans` maps a table name
+    to the reason a full read of it is expected."""
+
+
+def case(name, method, path, budget, role=None, status=200, body=None, setup=None, allow_scans=None):
+    return Case(name, method, path, role, status, budget, body, setup, allow_scans or {})
+
+
+def _png():
+    buffer = io.BytesIO()
+    Image.new('RGB', (800, 600), (200, 40, 40)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def _warm(client, headers, seeded, path):
+    # Load per-worker state (such as the catalog snapshot) outside the measurement
+    client.get(path.format(**seeded), headers=headers)
+
+
+def _seller_product(client, headers, seeded):
+    return {'seller_product_id': client.get('/seller/products', headers=headers).json[0]['id']}
+
+
+def _uploaded_image(client, headers, seeded):
+    product_id = _seller_product(client, headers, seeded)['seller_product_id']
+    response = client.post(f"/seller/products/{product_id}/image", headers=headers,
+                           data={'image': (io.BytesIO(_png()), 'photo.png')})
+    return {'thumbnail_url': response.json['thumbnails']['160']['webp']}
+
+
+def _bulk_update_body(client, headers, ids):
+    products = client.get('/seller/products', headers=headers).json
+    return {'products': [{'id': p['id'], 'version': p['version'], 'price': round(p['price'] * 1.1, 2),
+                          'stock': p['stock'] + 1} for p in products]}
+
+
+def _cart_of(client, headers, seeded, product_ids):
+    # Exactly these products, one of each, whatever earlier tests left in the cart
+    for line in client.get('/cart/get', headers=headers).json['cart_items']:
+        client.delete(f"/cart/{line['id']}", headers=headers)
+    for product_id in product_ids:
+        client.post('/cart', json={'productId': product_id, 'quantity': 1}, headers=headers)
+
+
+def _cart_line(client, headers, seeded):
+    response = client.post('/cart', json={'productId': 5, 'quantity': 1}, headers=headers)
+    return {'cart_line_id': response.json['cart_item_id']}
+
+
+def _logged_change(client, headers, seeded):
+    client.post('/seller/products', headers=headers, json={
+        'name': 'Streamed product', 'description': 'Fresh', 'price': 9.99, 'stock': 3,
+        'category_id': 3, 'image': 'https://img.example.com/streamed.jpg'})
+
+
+def _register_body(client, headers, seeded):
+    name = uuid.uuid4().hex[:12]
+    return {'username': name, 'password': 'secret', 'role': 'customer', 'name': name,
+            'email': f'{name}@example.com', 'address': '1 Test Rd', 'phone_no': 700000000}
+
+
+CASES = [
+    case('index', 'GET', '/', Budget(0, 20, 1)),
+    case('login', 'POST', '/login', Budget(1, 3000, 2),
+         body={'username': 'admin', 'password': 'perf-password'}),
+    case('register', 'POST', '/register', Budget(4, 3000, 1), status=201, body=_register_body),
+    case('categories with products', 'GET', '/categories/products', Budget(3, 1500, 4096),
+         allow_scans={'product': 'lists every product of every category'}),
+    case('categories', 'GET', '/categories', Budget(1, 100, 8)),
+    case('categories summary', 'GET', '/categories/summary', Budget(1, 100, 8)),
+    case('product facets', 'GET', '/products/facets?category_id=3&in_stock=true', Budget(0, 100, 8),
+         setup=lambda c, h, s: _warm(c, h, s, '/products/facets')),
+    case('related products', 'GET', '/products/{product_id}/related', Budget(1, 100, 8)),
+    case('single-flight metrics', 'GET', '/metrics/singleflight', Budget(0, 50, 1)),
+    case('products by category', 'GET', '/categories/3/products', Budget(1, 1000, 256)),
+    case('product search', 'GET', '/products?category_id=3&min_price=20&sort=price_asc&limit=50',
+         Budget(1, 150, 64)),
+    case('product search by name', 'GET', '/products?q=Product 12&limit=20', Budget(1, 300, 32),
+         allow_scans={'product': 'a substring match on the name cannot use an index'}),
+    case('seller products', 'GET', '/seller/products', Budget(1, 150, 128), role='seller'),
+    case('add product', 'POST', '/seller/products', Budget(5, 150, 1), role='seller', status=201,
+         body={'name': 'New product', 'description': 'Fresh', 'price': 19.99, 'stock': 7,
+               'category_id': 3, 'image': 'https://img.example.com/new.jpg'}),
+    case('bulk update products', 'PATCH', '/seller/products', Budget(8, 1000, 16), role='seller',
+         body=_bulk_update_body),
+    case('upload product image', 'POST', '/seller/products/{seller_product_id}/image', Budget(3, 5000, 2),
+         role='seller', status=201, setup=_seller_product,
+         body=lambda c, h, s: {'image': (io.BytesIO(_png()), 'photo.png')}),
+    case('serve image', 'GET', '{thumbnail_url}', Budget(0, 100, 64), setup=_uploaded_image,
+         role='seller'),
+    case('seller product', 'GET', '/seller/products/{product_id}', Budget(1, 50, 1), role='seller'),
+    case('seller buyers', 'GET', '/seller/buyers', Budget(4, 500, 128), role='seller'),
+    case('buyer orders', 'GET', '/buyers/orders', Budget(3, 150, 16), role='customer'),
+    case('admin sellers', 'GET', '/admin/seller', Budget(1, 150, 64), role='admin'),
+    case('admin order summary', 'GET', '/admin/orders/summary', Budget(2, 500, 1), role='admin',
+         allow_scans={'order': 'totals every order', 'archived_order': 'totals every archived order'}),
+    case('approve seller', 'PUT', '/admin/seller/{spare_seller_ids[0]}/approve', Budget(2, 100, 1),
+         role='admin'),
+    case('decline seller', 'PUT', '/admin/seller/{spare_seller_ids[1]}/decline', Budget(3, 100, 1),
+         role='admin'),
+    case('add to cart', 'POST', '/cart', Budget(7, 150, 1), role='customer', status=201,
+         body={'productId': 1, 'quantity': 2}),
+    case('cart items', 'GET', '/cart/get', Budget(3, 100, 8), role='customer'),
+    case('remove from cart', 'DELETE', '/cart/{cart_line_id}', Budget(5, 100, 1), role='customer',
+         setup=_cart_line),
+    # Two statements per cart line (the stock guard and the order insert), three lines
+    case('place order', 'POST', '/orders', Budget(16, 300, 1), role='customer', status=201,
+         setup=lambda c, h, s: _cart_of(c, h, s, (2, 3, 4))),
+    case('orders', 'GET', '/orders/get', Budget(3, 150, 16), role='customer'),
+    # Replays the log, including the change its setup made, then waits out the stream
+    case('catalog changes', 'GET', '/catalog/changes?category_id=3&last_event_id=0', Budget(2, 500, 32),
+         role='seller', setup=_logged_change),
+]
+
+
+def _full_scans(plan, large_tables):
+    # "SCAN product" reads every row; "SCAN product USING INDEX ..." walks an
+    # index and is fine (it stops at LIMIT or is range-bounded elsewhere)
+    scanned = set()
+    for step in plan:
+        match = re.fullmatch(r'SCAN (\w+)', step)
+        if match:
+            table = re.sub(r'_\d+$', '', match.group(1))
+            if table in large_tables:
+                scanned.add(table)
+    return scanned
+
+
+@pytest.mark.parametrize('case', CASES, ids=[case.name for case in CASES])
+def test_route_within_budget(case, client, tokens, seeded, large_tables):
+    headers = {'Authorization': f"Bearer {tokens[case.role]}"} if case.role else {}
+    ids = dict(seeded, **(case.setup(client, headers, seeded) or {})) if case.setup else seeded
+    body = case.body(client, headers, ids) if callable(case.body) else case.body
+    request = {'json': body} if isinstance(body, dict) and not any(
+        isinstance(value, tuple) for value in body.values()) else {'data': body}
+
+    with recorded_queries() as statements:
+        start = time.perf_counter()
+        response = client.open(case.path.format(**ids), method=case.method, headers=headers, **request)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+    assert response.status_code == case.status, response.get_data(as_text=True)[:500]
+
+    problems = []
+    if len(statements) > case.budget.queries:
+        problems.append(f"{len(statements)} queries (budget {case.budget.queries}):\n    "
+                        + "\n    ".join(sql for sql, _ in statements))
+    if elapsed_ms > case.budget.ms * TIME_FACTOR:
+        problems.append(f"{elapsed_ms:.0f} ms (budget {case.budget.ms * TIME_FACTOR:.0f} ms)")
+    size_kb = len(response.get_data()) / 1024
+    if size_kb > case.budget.kb:
+        problems.append(f"{size_kb:.1f} KiB response (budget {case.budget.kb} KiB)")
+
+    for sql, parameters in statements:
+        if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH')):
+            continue
+        plan = query_plan(sql, parameters)
+        for table in _full_scans(plan, large_tables) - set(case.allow_scans):
+            problems.append(f"full scan of {table}:\n    {sql}\n    plan: {plan}")
+
+    assert not problems, f"{case.method} {case.path} over budget:\n" + "\n".join(problems)
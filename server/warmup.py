@@ -0,0 +1,20 @@
+# Warms the catalog read paths before a server takes traffic.
+#
+# Requests each catalog route once through the test client, which loads the
+# in-memory catalog snapshot and fills SQLAlchemy's statement cache. When the
+# app is preloaded in the gunicorn master this happens once, before the
+# workers are forked, and every worker starts with the warm state.
+
+WARM_PATHS = (
+    '/categories/summary',
+    '/categories/products',
+    '/products',
+    '/products?sort=price_asc',
+    '/products/facets',
+)
+
+
+def warm_up(app):
+    """Hit every warm-up path once. Returns {path: status code}."""
+    client = app.test_client()
+    return {path: client.get(path).status_code for path in WARM_PATHS}
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+# Background job worker. Run one or more of these next to the web server:
+#
+#     python worker.py
+#
+# Each worker polls the job table, claims a batch of due jobs and runs them.
+
+# Standard library imports
+import os
+import socket
+import time
+
+# Local imports
+from app import app
+import jobs
+import tasks  # registers the job handlers
+
+if __name__ == '__main__':
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    with app.app_context():
+        print(f"Worker {worker_id} started, handling: {', '.join(sorted(jobs.handlers))}")
+        last_requeue = 0
+        while True:
+            if time.monotonic() - last_requeue > app.config['JOB_LOCK_TIMEOUT_SECONDS']:
+                requeued = jobs.requeue_stale()
+                if requeued:
+                    print(f"Requeued {requeued} stale jobs.")
+                last_requeue = time.monotonic()
+
+            if not jobs.run_pending(worker_id):
+                time.sleep(app.config['JOB_POLL_INTERVAL_SECONDS'])